@@ -1,13 +1,17 @@
 import streamlit as st
-import os
-import cv2
-import numpy as np
-from PIL import Image
+import hashlib
 import io
-import base64
-from app.utils.ocr import extract_text_from_image, extract_text_from_pdf
-from app.utils.verification import verify_prescription
-import tempfile
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+from app.utils.upload import spool_upload, MAX_UPLOAD_BYTES
+from app.utils.admission import Overloaded, ocr_limiter
+
+# Concurrent pipeline runs shared by all sessions. Sized to what the OCR stage
+# admits (running plus queued), so extra sessions wait here instead of being rejected
+OCR_WORKERS = int(os.getenv('STREAMLIT_OCR_WORKERS', str(ocr_limiter.max_concurrent + ocr_limiter.max_queue)))
+# Unrecorded results are reused for this long; duplicate verdicts go stale after that
+RESULT_CACHE_SECONDS = int(os.getenv('STREAMLIT_RESULT_CACHE_SECONDS', '300'))
 
 # Set page config
 st.set_page_config(
@@ -56,49 +60,177 @@ This application helps verify the authenticity of medical prescriptions using ad
 Upload a prescription image or PDF to get started.
 """)
 
+@st.cache_resource(show_spinner="Loading models...")
+def load_pipeline() -> Dict[str, Any]:
+    """
+    Load the models and indexes once per server process; Streamlit reruns
+    this script on every interaction, but cached resources survive reruns
+    and are shared by every session
+    """
+    from app.pipeline import run_verification
+    from app.utils.drug_analysis import get_nlp
+    from app.utils.text_index import prescription_text_index
+
+    return {
+        'run_verification': run_verification,
+        'nlp': get_nlp(),
+        'text_index': prescription_text_index,
+        'ocr_pool': ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+    }
+
+@st.cache_resource(show_spinner=False)
+def init_database() -> bool:
+    """
+    Create the database indexes once per server process; a failure is not
+    cached, so the next verification tries again
+    """
+    from app.models.database import init_db
+    init_db()
+    return True
+
+def verify_document(filename: str, record: bool, full_report: bool, data: bytes) -> Dict[str, Any]:
+    """Run the /api/verify pipeline on an in-memory upload"""
+    pipeline = load_pipeline()
+
+    def run():
+        # Held in memory up to the upload limit, so images are never spooled to disk.
+        # PDFs still are: pdf2image (pdfinfo/pdftoppm) writes its input to a temporary file
+        upload = spool_upload(io.BytesIO(data), filename, max_memory=MAX_UPLOAD_BYTES)
+        with upload:
+            return pipeline['run_verification'](upload, record=record, full_report=full_report)
+
+    return pipeline['ocr_pool'].submit(run).result()
+
+@st.cache_data(show_spinner=False, max_entries=512, ttl=RESULT_CACHE_SECONDS)
+def verify_document_cached(digest: str, filename: str, full_report: bool, _data: bytes) -> Dict[str, Any]:
+    """
+    verify_document without recording, cached by content hash so reruns and
+    repeat uploads skip processing
+    """
+    return verify_document(filename, False, full_report, _data)
+
+def verify_upload(uploaded_file, data: bytes, record: bool, full_report: bool) -> Dict[str, Any]:
+    """
+    Verify an upload. Recorded runs bypass the cache, so a resubmission is
+    checked against (and added to) the indexes; they are kept for the session
+    so the reruns Streamlit makes on every interaction do not record the
+    same upload again
+    """
+    if not record:
+        return verify_document_cached(hashlib.sha256(data).hexdigest(), uploaded_file.name, full_report, data)
+    key = (uploaded_file.file_id, full_report)
+    if st.session_state.get('recorded_key') != key:
+        st.session_state['recorded_results'] = verify_document(uploaded_file.name, True, full_report, data)
+        st.session_state['recorded_key'] = key
+    return st.session_state['recorded_results']
+
+def show_results(results: Dict[str, Any]):
+    """Render the verification results; sections of tiers that did not run are None"""
+    decision = results['decision']
+    doctor = results['doctor_verification']
+    tampering = results['tampering_detection']
+    duplicates = results['duplicate_detection']
+    similar = results['similar_prescriptions']
+    drugs = results['drug_analysis']
+
+    verdict = {'reject': st.error, 'review': st.warning, 'accept': st.success}[decision['verdict']]
+    verdict(f"Verdict: {decision['verdict'].title()} (fraud score {decision['fraud_score']:.2f})")
+    if decision['short_circuited_after']:
+        st.caption(f"Stopped after the {decision['short_circuited_after'].replace('_', ' ')} check; "
+                   f"skipped: {', '.join(decision['tiers_skipped'])}")
+
+    col1, col2, col3 = st.columns(3)
+    if doctor is None:
+        col1.metric("Doctor License", "Skipped")
+    else:
+        col1.metric("Doctor License", "✅ Valid" if doctor['is_valid'] else "❌ Invalid")
+    if tampering is None:
+        col2.metric("Tampering", "Skipped")
+    else:
+        col2.metric("Tampering", "❌ Suspected" if tampering['is_tampered'] else "✅ None detected",
+                    f"{tampering['confidence']:.0%} confidence", delta_color="off")
+    col3.metric("Medication Risk", "Skipped" if drugs is None else drugs.get('risk_level', 'unknown').title())
+
+    if duplicates and duplicates['is_duplicate']:
+        st.warning(f"Near-duplicate of {len(duplicates['matches'])} earlier submission(s)")
+        st.dataframe(duplicates['matches'], use_container_width=True)
+    if similar and similar['has_similar']:
+        st.warning(f"Text matches {len(similar['matches'])} earlier prescription(s)")
+        st.dataframe(similar['matches'], use_container_width=True)
+
+    if results['extracted_data'] is not None:
+        st.subheader("Extracted Text")
+        st.text_area("Extracted Text", results['extracted_data']['prescription_text'],
+                     height=200, label_visibility="collapsed")
+
+    st.subheader("Doctor Verification")
+    if doctor is None:
+        st.caption("Skipped")
+    elif doctor['is_valid']:
+        st.json(doctor['doctor_info'])
+        anomaly = doctor.get('anomaly', {})
+        if anomaly.get('score') is not None:
+            st.markdown(f"**Prescriber anomaly score:** {anomaly['score']:.2f}")
+            for factor in anomaly['factors']:
+                st.markdown(f"- {factor}")
+    else:
+        st.error(doctor['message'])
+
+    st.subheader("Document Analysis")
+    if tampering is None:
+        st.caption("Skipped")
+    else:
+        for issue in tampering['detected_issues']:
+            st.markdown(f"- {issue}")
+
+    st.subheader("Medication Analysis")
+    if drugs is None:
+        st.caption("Skipped")
+    else:
+        for warning in drugs.get('warnings', []):
+            st.warning(warning)
+    with st.expander("Full report"):
+        st.json(results)
+
+record = st.sidebar.checkbox("Record results to the audit trail", value=False)
+full_report = st.sidebar.checkbox("Full report (run every check)", value=True,
+                                  help="Otherwise verification stops at the first check that rejects the prescription")
+
 # File upload section
 st.markdown('<div class="upload-section">', unsafe_allow_html=True)
 uploaded_file = st.file_uploader("Upload Prescription", type=['jpg', 'jpeg', 'png', 'pdf'])
 st.markdown('</div>', unsafe_allow_html=True)
 
 if uploaded_file is not None:
-    # Create a temporary file to store the uploaded file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_file_path = tmp_file.name
+    data = uploaded_file.getvalue()
 
     try:
-        # Process the file based on its type
-        if uploaded_file.type == 'application/pdf':
-            extracted_text = extract_text_from_pdf(tmp_file_path)
-        else:
-            # Convert uploaded file to image
-            image = Image.open(uploaded_file)
-            image_np = np.array(image)
-            extracted_text = extract_text_from_image(image_np)
+        init_database()
+    except Exception as e:
+        print(f"Warning: Database initialization failed: {e}")
 
-        # Display results
-        st.markdown('<div class="result-section">', unsafe_allow_html=True)
-        st.subheader("Extracted Text")
-        st.text_area("", extracted_text, height=200)
-
-        # Verify prescription
-        verification_result = verify_prescription(extracted_text)
-        
-        st.subheader("Verification Results")
-        for key, value in verification_result.items():
-            if key == 'is_authentic':
-                st.markdown(f"**Prescription Status:** {'✅ Authentic' if value else '❌ Potentially Fake'}")
-            else:
-                st.markdown(f"**{key.replace('_', ' ').title()}:** {value}")
+    try:
+        with st.spinner("Analyzing prescription..."):
+            results = verify_upload(uploaded_file, data, record, full_report)
 
+        st.markdown('<div class="result-section">', unsafe_allow_html=True)
+        if 'error' in results:
+            st.error(results['error'])
+            if results.get('details'):
+                st.caption(results['details'])
+            if results.get('installation_guide'):
+                st.code(results['installation_guide'])
+        else:
+            if uploaded_file.type != 'application/pdf':
+                st.image(data, caption=uploaded_file.name, width=400)
+            show_results(results)
         st.markdown('</div>', unsafe_allow_html=True)
 
+    except Overloaded as e:
+        st.warning(f"The server is busy verifying other prescriptions. "
+                   f"Please try again in about {e.retry_after} seconds.")
     except Exception as e:
         st.error(f"Error processing file: {str(e)}")
-    finally:
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
 
 # Add footer
 st.markdown("---")
@@ -1,33 +1,114 @@
 # This file makes the app directory a Python package 
 
+import json
 import os
+import queue
+import threading
+import time
 # Disable oneDNN warnings
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
-from flask import Flask, render_template, request, jsonify
+from app.startup import timed, mark_ready, startup_report
+from flask import Flask, Request, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-from app.utils.ocr import process_document
-from app.utils.verification import verify_doctor, detect_tampering
-from app.utils.drug_analysis import analyze_prescription
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.utils.upload import SpooledUpload, UploadTooLarge, spool_upload, client_limits, MAX_UPLOAD_BYTES
 from app.models.database import init_db
+from app.models.reference_snapshot import snapshot_info
+from app.pipeline import run_verification, TIERS
+from app.utils.admission import Overloaded, admission_stats, check_admission
 
 # Load environment variables
 load_dotenv()
 
+class SpoolingRequest(Request):
+    """Stream uploaded files straight into a SpooledUpload instead of Werkzeug's own buffer"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledUpload(filename or '')
+
 # Create Flask app
 app = Flask(__name__, 
             static_folder='static',
             template_folder='templates')
+app.request_class = SpoolingRequest
+# Reject oversized bodies before they are read (multipart overhead allowed on top)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
 CORS(app)
 
-# Initialize database
-init_db()
+# Warn at startup if the admission limits could never queue or reject a request
+check_admission()
+
+# Initialize database on the first request rather than at import,
+# so workers start without waiting on the network
+_db_initialized = False
+_db_init_lock = threading.Lock()
+_db_init_next_attempt = 0.0
+DB_INIT_RETRY_SECONDS = float(os.getenv('DB_INIT_RETRY_SECONDS', '30'))
+
+# Routes that never touch the database, so they stay fast while it is down
+DB_FREE_ENDPOINTS = {'static', 'index', 'health', 'limits'}
+
+@app.before_request
+def ensure_db_initialized():
+    global _db_initialized, _db_init_next_attempt
+    if _db_initialized or request.endpoint in DB_FREE_ENDPOINTS:
+        return
+    if time.monotonic() < _db_init_next_attempt:
+        return
+    # One request at a time tries; the others carry on instead of queueing
+    # behind a server-selection timeout
+    if not _db_init_lock.acquire(blocking=False):
+        return
+    try:
+        if not _db_initialized:
+            with timed('init_db'):
+                init_db()
+            _db_initialized = True
+    except Exception as e:
+        _db_init_next_attempt = time.monotonic() + DB_INIT_RETRY_SECONDS
+        app.logger.warning(f"Database initialization failed, will retry in {DB_INIT_RETRY_SECONDS:g}s: {str(e)}")
+    finally:
+        _db_init_lock.release()
+
+@app.errorhandler(RequestEntityTooLarge)
+@app.errorhandler(UploadTooLarge)
+def upload_too_large(e):
+    return jsonify({
+        'error': 'The uploaded file is too large.',
+        'details': f'Files up to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB are accepted.'
+    }), 413
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({
+        'error': 'The server is busy. Please retry shortly.',
+        'details': str(e),
+        'retry_after': e.retry_after
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/api/health')
+def health():
+    return jsonify({
+        'status': 'ok',
+        'startup': startup_report(),
+        'admission': admission_stats(),
+        'reference_snapshot': snapshot_info()
+    })
+
+@app.route('/api/limits')
+def limits():
+    response = jsonify(client_limits())
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
 @app.route('/api/verify', methods=['POST'])
 def verify_prescription():
     if 'file' not in request.files:
@@ -37,36 +118,87 @@ def verify_prescription():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
+    # Tiered by default; ?full_report=1 runs every check regardless of the score
+    full_report = request.values.get('full_report', '').lower() in ('1', 'true', 'yes')
+
+    upload = spool_upload(file.stream, file.filename)
+    if request.values.get('progress', '').lower() in ('1', 'true', 'yes'):
+        return stream_verification(upload, full_report)
     try:
-        # Process document and extract text
-        extracted_data = process_document(file)
+        results = run_verification(upload, full_report=full_report)
         
         # Check if there was an error during document processing
-        if 'error' in extracted_data:
-            return jsonify(extracted_data), 400
-        
-        # Verify doctor's license
-        doctor_verification = verify_doctor(extracted_data.get('doctor_license'))
-        
-        # Detect tampering
-        tampering_detection = detect_tampering(file)
-        
-        # Analyze drug patterns
-        drug_analysis = analyze_prescription(extracted_data.get('prescription_text'))
+        if 'error' in results:
+            return jsonify(results), 400
         
         return jsonify({
             'status': 'success',
-            'data': {
-                'extracted_data': extracted_data,
-                'doctor_verification': doctor_verification,
-                'tampering_detection': tampering_detection,
-                'drug_analysis': drug_analysis
-            }
+            'data': results
         })
     
+    except Overloaded:
+        raise
     except Exception as e:
         app.logger.error(f"Error processing prescription: {str(e)}")
         return jsonify({
             'error': 'An unexpected error occurred while processing the prescription.',
             'details': str(e)
-        }), 500 
\ No newline at end of file
+        }), 500
+    finally:
+        upload.close()
+
+def stream_verification(upload: SpooledUpload, full_report: bool) -> Response:
+    """
+    Verify an upload, streaming newline-delimited JSON: a 'tier' event as each
+    verification tier starts, then a 'result' event carrying the HTTP status and
+    body the plain endpoint would have returned. The response itself is always
+    200 once streaming has started.
+    """
+    events = queue.Queue()
+
+    def on_tier(tier):
+        events.put({'event': 'tier', 'tier': tier, 'step': TIERS.index(tier) + 1, 'steps': len(TIERS)})
+
+    def run():
+        try:
+            results = run_verification(upload, full_report=full_report, on_tier=on_tier)
+            if 'error' in results:
+                status, body = 400, results
+            else:
+                status, body = 200, {'status': 'success', 'data': results}
+        except Overloaded as e:
+            status, body = 429, {
+                'error': 'The server is busy. Please retry shortly.',
+                'details': str(e),
+                'retry_after': e.retry_after
+            }
+        except Exception as e:
+            app.logger.error(f"Error processing prescription: {str(e)}")
+            status, body = 500, {
+                'error': 'An unexpected error occurred while processing the prescription.',
+                'details': str(e)
+            }
+        finally:
+            upload.close()
+        events.put({'event': 'result', 'status': status, 'body': body})
+
+    worker = threading.Thread(target=run, name='verify-stream', daemon=True)
+    worker.start()
+
+    def generate():
+        try:
+            while True:
+                event = events.get()
+                yield json.dumps(event, default=str) + '\n'
+                if event['event'] == 'result':
+                    break
+        finally:
+            # The request (and its upload) is torn down once streaming ends, so
+            # wait for verification even if the client went away
+            worker.join()
+
+    # stream_with_context keeps the request open until the generator finishes
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+mark_ready()
\ No newline at end of file
@@ -0,0 +1,282 @@
+"""
+Offline batch verifier.
+
+Runs the /api/verify pipeline over a directory, .zip or .tar archive of
+prescriptions with a pool of worker processes:
+
+    python -m app.batch prescriptions/ --output results.jsonl --workers 8
+    python -m app.batch scans.zip --output results/ --format parquet
+
+Results are written incrementally, and the key of every finished document
+is appended to a checkpoint file, so re-running the same command after an
+interruption skips everything already done. A document the pipeline could
+not process (no extractable text, too many pages, a corrupt image) is
+finished too. A document whose verification raised (for example while a
+database was unreachable) is retried by the next run; its record from the
+earlier run stays in the output.
+
+With --record, each document is recorded under a submission key made of
+the source path and member name. A document processed again after a crash
+is therefore not flagged as a duplicate of itself, though its audit record
+and prescriber statistics are written a second time.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Iterator, List, Tuple
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+# A task is (key, kind, location, payload): payload holds the bytes for tar members only
+Task = Tuple[str, str, str, Any]
+
+
+def iter_tasks(source: str) -> Iterator[Task]:
+    """Yield one task per supported document in a directory or archive"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, source), 'path', path, None
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    yield info.filename, 'zip', source, None
+    elif tarfile.is_tarfile(source):
+        # Tar members can only be read in order, so their bytes travel with the task
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    yield member.name, 'tar', source, archive.extractfile(member).read()
+    else:
+        raise ValueError(f'{source} is not a directory, zip or tar archive')
+
+
+_worker_record = False
+_worker_full_report = False
+_zip_handles: Dict[str, zipfile.ZipFile] = {}
+
+
+def _init_worker(record: bool, full_report: bool):
+    global _worker_record, _worker_full_report
+    _worker_record = record
+    _worker_full_report = full_report
+    from multiprocessing.util import Finalize
+    from app.pipeline import flush_pipeline
+    # Worker processes skip atexit, so flush buffered writes on pool shutdown instead
+    Finalize(None, flush_pipeline, exitpriority=10)
+
+
+def _open_task(kind: str, location: str, key: str, payload: Any):
+    if kind == 'path':
+        return open(location, 'rb')
+    if kind == 'zip':
+        if location not in _zip_handles:
+            _zip_handles[location] = zipfile.ZipFile(location)
+        return _zip_handles[location].open(key)
+    return io.BytesIO(payload)
+
+
+def _submission_key(kind: str, location: str, key: str) -> str:
+    """Stable identity of a source document across runs"""
+    if kind == 'path':
+        return os.path.abspath(location)
+    return f'{os.path.abspath(location)}!{key}'
+
+
+def verify_task(task: Task) -> Dict[str, Any]:
+    """Run the verification pipeline on one document (executed in a worker)"""
+    from app.pipeline import run_verification
+    from app.utils.upload import spool_upload
+
+    key, kind, location, payload = task
+    started = time.perf_counter()
+    record = {'key': key}
+    try:
+        with _open_task(kind, location, key, payload) as stream:
+            upload = spool_upload(stream, os.path.basename(key))
+        with upload:
+            results = run_verification(upload, record=_worker_record, full_report=_worker_full_report,
+                                       submission_key=_submission_key(kind, location, key))
+        if 'error' in results:
+            record.update(status='error', error=results['error'], result=results)
+        else:
+            record.update(status='success', result=results)
+    except Exception as e:
+        # No 'result': the run did not finish, so the checkpoint leaves it for a retry
+        record.update(status='error', error=str(e))
+    record['elapsed'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+class Checkpoint:
+    """Append-only list of the keys of finished documents"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done.update(line.rstrip('\n') for line in f if line.strip())
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def commit(self, keys: List[str]):
+        self._file.write(''.join(key + '\n' for key in keys))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.update(keys)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records: List[Dict[str, Any]]):
+        self._file.write(''.join(json.dumps(r, default=str) + '\n' for r in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Writes each batch of results as a new part file in the output directory"""
+
+    def __init__(self, directory: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit('Parquet output requires pyarrow: pip install pyarrow')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._run = time.strftime('%Y%m%d-%H%M%S')
+        self._part = 0
+
+    def write(self, records: List[Dict[str, Any]]):
+        rows = []
+        for r in records:
+            result = r.get('result') or {}
+            rows.append({
+                'key': r['key'],
+                'status': r['status'],
+                'error': r.get('error'),
+                'elapsed': r['elapsed'],
+                'doctor_license': (result.get('extracted_data') or {}).get('doctor_license'),
+                'license_valid': (result.get('doctor_verification') or {}).get('is_valid'),
+                'is_tampered': (result.get('tampering_detection') or {}).get('is_tampered'),
+                'is_duplicate': (result.get('duplicate_detection') or {}).get('is_duplicate'),
+                'risk_level': (result.get('drug_analysis') or {}).get('risk_level'),
+                'result_json': json.dumps(result, default=str)
+            })
+        self._part += 1
+        path = os.path.join(self.directory, f'part-{self._run}-{self._part:06d}.parquet')
+        self._pq.write_table(self._pa.Table.from_pylist(rows), path)
+
+    def close(self):
+        pass
+
+
+def run_batch(source: str, output: str, output_format: str = 'jsonl', workers: int = None,
+              flush_every: int = 100, record: bool = False, full_report: bool = False) -> Dict[str, int]:
+    """Verify every document under source, resuming from the checkpoint next to output"""
+    workers = workers or os.cpu_count() or 1
+    try:
+        # Without the indexes every duplicate and history lookup is a collection scan
+        from app.models.database import init_db
+        init_db()
+    except Exception as e:
+        print(f"Warning: Database initialization failed: {e}", file=sys.stderr)
+    checkpoint = Checkpoint(output.rstrip('/\\') + '.checkpoint')
+    writer = ParquetWriter(output) if output_format == 'parquet' else JsonlWriter(output)
+    counts = {'success': 0, 'error': 0, 'skipped': 0}
+    pending_records: List[Dict[str, Any]] = []
+
+    def flush():
+        if pending_records:
+            # Results are durable before their keys are checkpointed, so a crash
+            # can only cause a document to be processed twice, never skipped.
+            # Runs that raised are not checkpointed, so a rerun retries them;
+            # documents the pipeline rejected would only fail the same way again
+            writer.write(pending_records)
+            checkpoint.commit([r['key'] for r in pending_records if 'result' in r])
+            pending_records.clear()
+
+    # Spawned workers start with fresh database clients instead of forked ones
+    context = multiprocessing.get_context('spawn')
+    max_in_flight = workers * 4
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(record, full_report)) as pool:
+            in_flight = set()
+            for task in iter_tasks(source):
+                if task[0] in checkpoint.done:
+                    counts['skipped'] += 1
+                    continue
+                # Bounded submission keeps memory flat on very large inputs
+                if len(in_flight) >= max_in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        r = future.result()
+                        counts[r['status']] += 1
+                        pending_records.append(r)
+                    if len(pending_records) >= flush_every:
+                        flush()
+                in_flight.add(pool.submit(verify_task, task))
+
+            for future in wait(in_flight).done:
+                r = future.result()
+                counts[r['status']] += 1
+                pending_records.append(r)
+    finally:
+        flush()
+        writer.close()
+        checkpoint.close()
+
+    processed = counts['success'] + counts['error']
+    elapsed = time.perf_counter() - started
+    print(f"Processed {processed} documents ({counts['error']} errors, {counts['skipped']} already done) "
+          f"in {elapsed:.1f}s", file=sys.stderr)
+    return counts
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Verify a directory or archive of prescriptions offline.')
+    parser.add_argument('source', help='Directory, .zip or .tar(.gz) archive of prescriptions')
+    parser.add_argument('--output', '-o', required=True,
+                        help='JSONL file, or output directory for --format parquet')
+    parser.add_argument('--format', choices=('jsonl', 'parquet'), default='jsonl')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(),
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--flush-every', type=int, default=100,
+                        help='Write results and checkpoint after this many documents')
+    parser.add_argument('--record', action='store_true',
+                        help='Persist results and update the duplicate, text and prescriber indexes')
+    parser.add_argument('--full-report', action='store_true',
+                        help='Run every verification tier instead of stopping once a document is rejected')
+    args = parser.parse_args(argv)
+
+    counts = run_batch(args.source, args.output, args.format, args.workers,
+                       args.flush_every, args.record, args.full_report)
+    return 1 if counts['error'] and not counts['success'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,41 +1,77 @@
 import os
-from typing import Dict, Any, Optional
+import threading
+from typing import Dict, Any, Iterator, Optional, List
 import pymongo
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from bson.int64 import Int64
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from app.models.reference_snapshot import get_reference_snapshot
 
 # Load environment variables
 load_dotenv()
 
-# Initialize MongoDB client
-mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = mongo_client['medauth']
-
-# Initialize PostgreSQL connection
-pg_conn = None
-try:
-    # Use direct connection string from environment variable
-    pg_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-except psycopg2.OperationalError as e:
-    print(f"Warning: Could not connect to PostgreSQL: {e}")
-    print("The application will continue with MongoDB only.")
-    pg_conn = None
-except Exception as e:
-    print(f"Warning: Unexpected error connecting to PostgreSQL: {e}")
-    print("The application will continue with MongoDB only.")
-    pg_conn = None
+# Connections are opened on first use (and re-opened in forked workers),
+# so importing this module never touches the network
+_mongo_client = None
+_mongo_pid = None
+_pg_conn = None
+_pg_pid = None
+_connect_lock = threading.Lock()
+
+def get_db():
+    """Get the MongoDB database, connecting on first use in this process"""
+    global _mongo_client, _mongo_pid
+    if _mongo_pid != os.getpid():
+        with _connect_lock:
+            if _mongo_pid != os.getpid():
+                # MongoClient is not fork-safe, so each process gets its own
+                _mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+                _mongo_pid = os.getpid()
+    return _mongo_client['medauth']
+
+def get_pg_conn():
+    """Get the PostgreSQL connection, or None if PostgreSQL is unavailable"""
+    global _pg_conn, _pg_pid
+    if _pg_pid != os.getpid():
+        with _connect_lock:
+            if _pg_pid != os.getpid():
+                try:
+                    # Use direct connection string from environment variable
+                    _pg_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+                except psycopg2.OperationalError as e:
+                    print(f"Warning: Could not connect to PostgreSQL: {e}")
+                    print("The application will continue with MongoDB only.")
+                    _pg_conn = None
+                except Exception as e:
+                    print(f"Warning: Unexpected error connecting to PostgreSQL: {e}")
+                    print("The application will continue with MongoDB only.")
+                    _pg_conn = None
+                _pg_pid = os.getpid()
+    return _pg_conn
 
 def init_db():
     """Initialize database collections and tables"""
+    db = get_db()
+    pg_conn = get_pg_conn()
+    
     # MongoDB collections
     doctors = db['doctors']
     prescriptions = db['prescriptions']
+    image_fingerprints = db['image_fingerprints']
     
     # Create indexes
     doctors.create_index([('license_number', pymongo.ASCENDING)], unique=True)
-    prescriptions.create_index([('doctor_license', pymongo.ASCENDING)])
+    # Serves history lookups by license sorted by newest first
+    prescriptions.create_index([
+        ('doctor_license', pymongo.ASCENDING),
+        ('timestamp', pymongo.DESCENDING)
+    ])
+    # Multi-index hashing: one multikey entry per perceptual hash block
+    image_fingerprints.create_index([('phash_blocks', pymongo.ASCENDING)])
+    image_fingerprints.create_index([('sha256', pymongo.ASCENDING)])
     
     # PostgreSQL tables (only if connection is available)
     if pg_conn:
@@ -72,11 +108,17 @@ def init_db():
 
 def get_doctor_by_license(license_number: str) -> Optional[Dict[str, Any]]:
     """Get doctor information by license number"""
-    return db.doctors.find_one({'license_number': license_number})
+    snapshot = get_reference_snapshot()
+    if snapshot is not None:
+        return snapshot.doctor(license_number)
+    return get_db().doctors.find_one({'license_number': license_number})
 
 def get_drug_interactions(drug1: str, drug2: str) -> Optional[Dict[str, Any]]:
     """Get drug interaction information"""
-    with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
+    snapshot = get_reference_snapshot()
+    if snapshot is not None:
+        return snapshot.drug_interaction(drug1, drug2)
+    with get_pg_conn().cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             SELECT * FROM drug_interactions 
             WHERE (drug1 = %s AND drug2 = %s) 
@@ -86,7 +128,10 @@ def get_drug_interactions(drug1: str, drug2: str) -> Optional[Dict[str, Any]]:
 
 def get_drug_contraindications(drug_name: str) -> Optional[Dict[str, Any]]:
     """Get drug contraindications"""
-    with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
+    snapshot = get_reference_snapshot()
+    if snapshot is not None:
+        return snapshot.drug_contraindication(drug_name)
+    with get_pg_conn().cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             SELECT * FROM drug_contraindications 
             WHERE drug_name = %s
@@ -95,25 +140,103 @@ def get_drug_contraindications(drug_name: str) -> Optional[Dict[str, Any]]:
 
 def save_prescription_verification(verification_data: Dict[str, Any]) -> str:
     """Save prescription verification results"""
-    result = db.prescriptions.insert_one(verification_data)
+    result = get_db().prescriptions.insert_one(verification_data)
     return str(result.inserted_id)
 
 def get_prescription_history(doctor_license: str, limit: int = 10) -> list:
     """Get prescription verification history for a doctor"""
-    return list(db.prescriptions.find(
+    return list(get_db().prescriptions.find(
         {'doctor_license': doctor_license},
         sort=[('timestamp', -1)],
         limit=limit
     ))
 
+FINGERPRINT_PROJECTION = {'phash': 1, 'dhash': 1, 'sha256': 1, 'filename': 1,
+                          'doctor_license': 1, 'timestamp': 1, 'submission_key': 1}
+
+# Bit masks for counting differing bits in an aggregation, as signed int64
+_BIT_MASKS = [Int64(1 << i) for i in range(63)] + [Int64(-(1 << 63))]
+# Cleared when the server lacks $bitXor/$bitAnd (MongoDB before 6.3)
+_server_hamming = True
+
+def _hamming_expr(field: str, value: int) -> Dict[str, Any]:
+    """Aggregation expression counting the bits in which a stored hash differs from value"""
+    return {'$let': {
+        'vars': {'diff': {'$bitXor': [{'$toLong': field}, Int64(value)]}},
+        'in': {'$reduce': {
+            'input': _BIT_MASKS,
+            'initialValue': 0,
+            'in': {'$add': ['$$value', {'$cond': [{'$eq': [{'$bitAnd': ['$$diff', '$$this']}, 0]}, 0, 1]}]}
+        }}
+    }}
+
+def find_near_image_fingerprints(blocks: List[int], phash: int, dhash: int, max_distance: int,
+                                 limit: int = 10, exclude_key: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get the stored image fingerprints sharing any of the given perceptual hash
+    blocks whose pHash is within max_distance of phash (both signed int64),
+    closest first, with 'distance' and 'dhash_distance' added. The distance
+    filter runs on the server in one aggregation; returns None if the server
+    cannot evaluate it, and the caller filters iter_image_fingerprints instead
+    """
+    global _server_hamming
+    if not _server_hamming:
+        return None
+    query: Dict[str, Any] = {'phash_blocks': {'$in': blocks}}
+    if exclude_key is not None:
+        query['submission_key'] = {'$ne': exclude_key}
+    try:
+        return list(get_db().image_fingerprints.aggregate([
+            {'$match': query},
+            {'$project': {**FINGERPRINT_PROJECTION,
+                          'distance': _hamming_expr('$phash', phash),
+                          'dhash_distance': _hamming_expr('$dhash', dhash)}},
+            {'$match': {'distance': {'$lte': max_distance}}},
+            {'$sort': {'distance': 1, 'dhash_distance': 1}},
+            {'$limit': limit}
+        ]))
+    except OperationFailure as e:
+        print(f"Warning: MongoDB cannot compare hashes on the server, filtering in the application: {e}")
+        _server_hamming = False
+        return None
+
+def iter_image_fingerprints(blocks: List[int], exclude_key: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over every stored image fingerprint containing any of the given
+    perceptual hash blocks, in one query. Not capped, since common blocks
+    (blank margins, letterheads) can match far more rows than the
+    near-duplicates among them
+    """
+    query: Dict[str, Any] = {'phash_blocks': {'$in': blocks}}
+    if exclude_key is not None:
+        query['submission_key'] = {'$ne': exclude_key}
+    return get_db().image_fingerprints.find(query, projection=FINGERPRINT_PROJECTION, batch_size=5000)
+
+def find_image_fingerprints_by_sha256(sha256: str, limit: int = 10,
+                                      exclude_key: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get stored image fingerprints of byte-identical uploads, except those recorded under exclude_key"""
+    query = {'sha256': sha256}
+    if exclude_key is not None:
+        query['submission_key'] = {'$ne': exclude_key}
+    return list(get_db().image_fingerprints.find(
+        query,
+        projection={'phash_blocks': 0},
+        sort=[('timestamp', -1)],
+        limit=limit
+    ))
+
+def get_prescriber_stats(license_number: str) -> Optional[Dict[str, Any]]:
+    """Get the running prescription aggregates for a doctor"""
+    return get_db().prescriber_stats.find_one({'_id': license_number})
+
 def add_doctor(doctor_data: Dict[str, Any]) -> str:
     """Add a new doctor to the database"""
-    result = db.doctors.insert_one(doctor_data)
+    result = get_db().doctors.insert_one(doctor_data)
     return str(result.inserted_id)
 
 def update_doctor_status(license_number: str, status: str) -> bool:
     """Update doctor's license status"""
-    result = db.doctors.update_one(
+    result = get_db().doctors.update_one(
         {'license_number': license_number},
         {'$set': {'status': status}}
     )
@@ -121,6 +244,7 @@ def update_doctor_status(license_number: str, status: str) -> bool:
 
 def add_drug_interaction(interaction_data: Dict[str, Any]) -> int:
     """Add a new drug interaction"""
+    pg_conn = get_pg_conn()
     with pg_conn.cursor() as cur:
         cur.execute("""
             INSERT INTO drug_interactions (drug1, drug2, severity, description)
@@ -140,6 +264,7 @@ def add_drug_interaction(interaction_data: Dict[str, Any]) -> int:
 
 def add_drug_contraindication(contraindication_data: Dict[str, Any]) -> int:
     """Add a new drug contraindication"""
+    pg_conn = get_pg_conn()
     with pg_conn.cursor() as cur:
         cur.execute("""
             INSERT INTO drug_contraindications (drug_name, conditions, severity)
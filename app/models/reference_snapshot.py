@@ -0,0 +1,282 @@
+"""
+Read-only snapshot of the reference data: drug interactions, drug
+contraindications and doctors.
+
+The snapshot is a single binary file that every worker memory-maps, so the
+reference tables are held once in the page cache however many workers run,
+and lookups need no database round trip:
+
+    python -m app.models.reference_snapshot --output reference.snapshot
+    REFERENCE_SNAPSHOT=reference.snapshot gunicorn -c gunicorn.conf.py app:app
+
+A rebuild writes a new file next to the old one and renames it into place.
+Running workers notice the new file within REFERENCE_SNAPSHOT_CHECK_INTERVAL
+seconds and switch to it; requests already holding the old mapping finish
+on it.
+
+Layout (little-endian): a header (magic, format, table count, version), a
+directory of (name, row count, offset) entries, then per table two offset
+arrays of count + 1 uint32 values followed by the keys and the values they
+index. Keys are UTF-8 and sorted, so a lookup is a binary search over the
+mapped keys; only the value that matches is decoded.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from bson import json_util
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+REFERENCE_SNAPSHOT = os.getenv('REFERENCE_SNAPSHOT')
+REFERENCE_SNAPSHOT_CHECK_INTERVAL = float(os.getenv('REFERENCE_SNAPSHOT_CHECK_INTERVAL', '5.0'))
+
+MAGIC = b'MDRS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+DIRECTORY_ENTRY = struct.Struct('<32sIQ4x')
+TABLES = ('interactions', 'contraindications', 'doctors')
+
+
+def interaction_key(drug1: str, drug2: str) -> str:
+    """Order-independent key of a drug pair"""
+    return '\0'.join(sorted((drug1, drug2)))
+
+
+class _Table:
+    """Sorted keys and their values, viewed in place in the mapped file"""
+
+    def __init__(self, buf: memoryview, offset: int, count: int):
+        width = 4 * (count + 1)
+        self.count = count
+        self.key_offsets = buf[offset:offset + width].cast('I')
+        self.value_offsets = buf[offset + width:offset + 2 * width].cast('I')
+        keys_start = offset + 2 * width
+        values_start = keys_start + self.key_offsets[count]
+        self.keys = buf[keys_start:values_start]
+        self.values = buf[values_start:values_start + self.value_offsets[count]]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        # Sequence protocol so bisect can search the keys directly
+        return bytes(self.keys[self.key_offsets[i]:self.key_offsets[i + 1]])
+
+    def get(self, key: str) -> Optional[Any]:
+        encoded = key.encode('utf-8')
+        i = bisect_left(self, encoded)
+        if i == self.count or self[i] != encoded:
+            return None
+        raw = self.values[self.value_offsets[i]:self.value_offsets[i + 1]]
+        return json_util.loads(str(raw, 'utf-8'))
+
+    def release(self):
+        for view in (self.key_offsets, self.value_offsets, self.keys, self.values):
+            view.release()
+
+
+class ReferenceSnapshot:
+    """A memory-mapped snapshot file"""
+
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise ValueError('Reference snapshots can only be read on little-endian machines')
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._tables: Dict[str, _Table] = {}
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self):
+        buf = memoryview(self._mmap)
+        try:
+            magic, file_format, table_count, self.version = HEADER.unpack_from(buf, 0)
+            if magic != MAGIC or file_format != FORMAT_VERSION:
+                raise ValueError(f'{self.path} is not a version {FORMAT_VERSION} reference snapshot')
+            for i in range(table_count):
+                name, count, offset = DIRECTORY_ENTRY.unpack_from(buf, HEADER.size + i * DIRECTORY_ENTRY.size)
+                self._tables[name.rstrip(b'\0').decode()] = _Table(buf, offset, count)
+        finally:
+            buf.release()
+        missing = set(TABLES) - set(self._tables)
+        if missing:
+            raise ValueError(f'{self.path} is missing the {", ".join(sorted(missing))} table(s)')
+
+    def drug_interaction(self, drug1: str, drug2: str) -> Optional[Dict[str, Any]]:
+        return self._tables['interactions'].get(interaction_key(drug1, drug2))
+
+    def drug_contraindication(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        return self._tables['contraindications'].get(drug_name)
+
+    def doctor(self, license_number: str) -> Optional[Dict[str, Any]]:
+        return self._tables['doctors'].get(license_number)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'version': self.version,
+            'rows': {name: len(table) for name, table in self._tables.items()}
+        }
+
+    def close(self):
+        for table in self._tables.values():
+            table.release()
+        self._mmap.close()
+
+
+def _table_bytes(rows: Iterable[Tuple[str, Any]]) -> Tuple[int, bytes]:
+    # Later rows win on duplicate keys
+    entries = sorted({key.encode('utf-8'): value for key, value in rows}.items())
+    keys, values = [], []
+    key_offsets, value_offsets = [0], [0]
+    for key, value in entries:
+        encoded = json_util.dumps(value).encode('utf-8')
+        keys.append(key)
+        values.append(encoded)
+        key_offsets.append(key_offsets[-1] + len(key))
+        value_offsets.append(value_offsets[-1] + len(encoded))
+    n = len(entries) + 1
+    data = struct.pack(f'<{n}I', *key_offsets) + struct.pack(f'<{n}I', *value_offsets)
+    data += b''.join(keys) + b''.join(values)
+    # Keep the next table's offset arrays 8-byte aligned
+    return len(entries), data + b'\0' * (-len(data) % 8)
+
+
+def write_snapshot(path: str, tables: Dict[str, Iterable[Tuple[str, Any]]]) -> int:
+    """
+    Write (key, value) rows per table to a new snapshot at path and return
+    its version. The file is written beside path and renamed over it, so
+    readers only ever see a complete snapshot.
+    """
+    version = time.time_ns()
+    compiled = [(name, *_table_bytes(rows)) for name, rows in tables.items()]
+
+    offset = HEADER.size + len(compiled) * DIRECTORY_ENTRY.size
+    offset += -offset % 8
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(compiled), version)
+    directory = b''
+    for name, count, data in compiled:
+        directory += DIRECTORY_ENTRY.pack(name.encode(), count, offset)
+        offset += len(data)
+    preamble = header + directory
+    preamble += b'\0' * (-len(preamble) % 8)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(preamble)
+            for _, _, data in compiled:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return version
+
+
+def build_snapshot(path: str) -> Dict[str, Any]:
+    """Compile the reference tables from MongoDB and PostgreSQL into a snapshot at path"""
+    from psycopg2.extras import RealDictCursor
+    from app.models.database import get_db, get_pg_conn
+
+    interactions: List[Dict[str, Any]] = []
+    contraindications: List[Dict[str, Any]] = []
+    pg_conn = get_pg_conn()
+    if pg_conn:
+        with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT * FROM drug_interactions ORDER BY id")
+            interactions = [dict(row) for row in cur.fetchall()]
+            cur.execute("SELECT * FROM drug_contraindications ORDER BY id")
+            contraindications = [dict(row) for row in cur.fetchall()]
+    else:
+        print("Warning: PostgreSQL unavailable; the snapshot will have no drug interactions or contraindications")
+
+    doctors = get_db().doctors.find({'license_number': {'$ne': None}})
+    version = write_snapshot(path, {
+        'interactions': ((interaction_key(row['drug1'], row['drug2']), row) for row in interactions),
+        'contraindications': ((row['drug_name'], row) for row in contraindications),
+        'doctors': ((doc['license_number'], doc) for doc in doctors)
+    })
+    snapshot = ReferenceSnapshot(path)
+    try:
+        return snapshot.info()
+    finally:
+        snapshot.close()
+
+
+_snapshot: Optional[ReferenceSnapshot] = None
+_snapshot_stat = None
+_checked_at = 0.0
+_load_error = None
+_snapshot_lock = threading.Lock()
+
+
+def get_reference_snapshot() -> Optional[ReferenceSnapshot]:
+    """
+    The current snapshot, or None if REFERENCE_SNAPSHOT is unset or cannot be
+    read. The file is re-checked every REFERENCE_SNAPSHOT_CHECK_INTERVAL
+    seconds and re-mapped if it was replaced.
+    """
+    global _snapshot, _snapshot_stat, _checked_at, _load_error
+    if not REFERENCE_SNAPSHOT:
+        return None
+    if time.monotonic() - _checked_at < REFERENCE_SNAPSHOT_CHECK_INTERVAL:
+        return _snapshot
+
+    with _snapshot_lock:
+        if time.monotonic() - _checked_at < REFERENCE_SNAPSHOT_CHECK_INTERVAL:
+            return _snapshot
+        try:
+            st = os.stat(REFERENCE_SNAPSHOT)
+            stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if stat != _snapshot_stat:
+                # The old mapping is not closed: other threads may still be reading it,
+                # and it is unmapped once the last reference goes away
+                _snapshot = ReferenceSnapshot(REFERENCE_SNAPSHOT)
+                _snapshot_stat = stat
+            _load_error = None
+        except (OSError, ValueError, struct.error) as e:
+            if str(e) != _load_error:
+                print(f"Warning: Could not load reference snapshot: {e}")
+                print("Reference lookups will use the database.")
+            _load_error = str(e)
+            _snapshot, _snapshot_stat = None, None
+        _checked_at = time.monotonic()
+    return _snapshot
+
+
+def snapshot_info() -> Optional[Dict[str, Any]]:
+    snapshot = get_reference_snapshot()
+    return snapshot.info() if snapshot else None
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build a reference data snapshot from the database.')
+    parser.add_argument('--output', '-o', default=REFERENCE_SNAPSHOT or 'reference.snapshot',
+                        help='Snapshot file to write (default: $REFERENCE_SNAPSHOT or reference.snapshot)')
+    args = parser.parse_args(argv)
+
+    info = build_snapshot(args.output)
+    rows = ', '.join(f'{count} {name}' for name, count in info['rows'].items())
+    print(f"Wrote {args.output} version {info['version']} ({rows})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.models.database import get_db
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: journal locking only covers threads of one process
+    fcntl = None
+
+# Write-behind settings (overridable through the environment)
+WRITE_BUFFER_SIZE = int(os.getenv('WRITE_BUFFER_SIZE', '10000'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', '2.0'))
+WRITE_JOURNAL_DIR = os.getenv('WRITE_JOURNAL_DIR', '.')
+# Replay files untouched for this long belong to a process that died mid-replay
+REPLAY_STALE_SECONDS = float(os.getenv('WRITE_REPLAY_STALE_SECONDS', '300'))
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue of documents flushed to a MongoDB collection with insert_many.
+
+    A batch is written once it reaches `batch_size` documents or `flush_interval`
+    seconds after its first document, whichever comes first. Documents that cannot
+    be written (Mongo unavailable, or the queue is full) are appended to a local
+    JSONL journal that is replayed when the writer starts and after each successful
+    flush; replay files left by a process that died mid-replay are picked up after
+    REPLAY_STALE_SECONDS. Every document
+    gets its `_id` before it is queued, so a replayed batch that was partially
+    written before is de-duplicated by Mongo.
+    """
+
+    def __init__(self, collection_name: str, max_pending: int = WRITE_BUFFER_SIZE,
+                 batch_size: int = WRITE_BATCH_SIZE, flush_interval: float = WRITE_FLUSH_INTERVAL,
+                 journal_dir: str = WRITE_JOURNAL_DIR):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = os.path.join(journal_dir, f'{collection_name}.journal.jsonl')
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._journal_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def submit(self, document: Dict[str, Any]) -> bool:
+        """
+        Queue a document for writing without blocking.
+        Returns False if the queue was full and the document went to the journal instead.
+        """
+        document.setdefault('_id', ObjectId())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(document)
+            return True
+        except queue.Full:
+            self._spill([document])
+            return False
+
+    def _ensure_started(self):
+        # Started lazily and restarted after fork, since threads do not survive it
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name=f'write-behind-{self.collection_name}', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        # Pick up whatever an earlier process left in the journal or was replaying when it died
+        self._replay_journal()
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+        self._drain()
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        if self._write(batch):
+            self._replay_journal()
+        else:
+            self._spill(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        try:
+            get_db()[self.collection_name].insert_many(batch, ordered=False)
+            return True
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            # Documents already present (from an earlier partial write) are not a failure
+            return bool(errors) and all(err.get('code') == DUPLICATE_KEY_ERROR for err in errors)
+        except PyMongoError as e:
+            print(f"Warning: Could not write {len(batch)} documents to {self.collection_name}: {e}")
+            return False
+
+    @contextmanager
+    def _journal_locked(self):
+        """
+        Hold the journal lock across threads and, through flock on a lock file,
+        across every process sharing the journal directory. Otherwise one process
+        could append to the journal just as another renames it away for replay
+        """
+        with self._journal_lock:
+            with open(self.journal_path + '.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _spill(self, documents: List[Dict[str, Any]]):
+        """Append documents to the local journal"""
+        with self._journal_locked():
+            with open(self.journal_path, 'a', encoding='utf-8') as journal:
+                for document in documents:
+                    journal.write(json_util.dumps(document) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def _claim_replay_files(self) -> List[str]:
+        """
+        Move the journal, and any replay file abandoned by a process that died
+        mid-replay, to replay files owned by this process
+        """
+        with self._journal_locked():
+            candidates = [self.journal_path] if os.path.exists(self.journal_path) else []
+            for path in glob.glob(glob.escape(self.journal_path) + '.*.replay'):
+                try:
+                    # The rename that claimed a file updates its ctime
+                    if time.time() - os.stat(path).st_ctime >= REPLAY_STALE_SECONDS:
+                        candidates.append(path)
+                except FileNotFoundError:
+                    pass
+
+            claimed = []
+            for path in candidates:
+                # Unique name, since workers may share one journal
+                replay_path = f'{self.journal_path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.replay'
+                try:
+                    os.replace(path, replay_path)
+                    claimed.append(replay_path)
+                except FileNotFoundError:
+                    pass
+            return claimed
+
+    def _replay_journal(self):
+        """Write journalled documents back to Mongo once it is reachable again"""
+        for replay_path in self._claim_replay_files():
+            failed = []
+            batch = []
+            with open(replay_path, encoding='utf-8') as journal:
+                for line in journal:
+                    if line.strip():
+                        batch.append(json_util.loads(line))
+                    if len(batch) >= self.batch_size:
+                        # Once Mongo is unreachable, keep the rest for the next replay
+                        if failed or not self._write(batch):
+                            failed.extend(batch)
+                        batch = []
+            if batch and (failed or not self._write(batch)):
+                failed.extend(batch)
+
+            if failed:
+                self._spill(failed)
+            try:
+                os.remove(replay_path)
+            except FileNotFoundError:
+                # Claimed by another process as abandoned; documents keep their _id,
+                # so replaying them twice only produces duplicate-key errors
+                pass
+
+    def close(self, timeout: float = 10.0):
+        """Stop the writer thread after flushing everything still queued"""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        else:
+            self._drain()
+
+
+class UpdateBehindBuffer(WriteBehindBuffer):
+    """
+    Write-behind buffer of upserts, each queued as {'key', 'update'}.
+
+    Updates to the same key within a batch are merged ($inc amounts summed,
+    $unset fields combined, the latest $set kept) and applied with one
+    bulk_write. Only the updates that failed are journalled, so a partially
+    applied batch is not counted twice on replay.
+    """
+
+    def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for item in batch:
+            update = merged.setdefault(item['key'], {})
+            for operator, fields in item['update'].items():
+                target = update.setdefault(operator, {})
+                for field, value in fields.items():
+                    target[field] = target.get(field, 0) + value if operator == '$inc' else value
+        keys = list(merged)
+        try:
+            get_db()[self.collection_name].bulk_write(
+                [UpdateOne({'_id': key}, merged[key], upsert=True) for key in keys],
+                ordered=False
+            )
+            return True
+        except BulkWriteError as e:
+            failed = [err['index'] for err in e.details.get('writeErrors', [])]
+            print(f"Warning: {len(failed)} updates to {self.collection_name} failed and were journalled")
+            self._spill([{'_id': ObjectId(), 'key': keys[i], 'update': merged[keys[i]]} for i in failed])
+            return True
+        except PyMongoError as e:
+            print(f"Warning: Could not write {len(batch)} updates to {self.collection_name}: {e}")
+            return False
+
+
+verification_writer = WriteBehindBuffer('prescriptions')
+fingerprint_writer = WriteBehindBuffer('image_fingerprints')
+prescriber_stats_writer = UpdateBehindBuffer('prescriber_stats')
+atexit.register(verification_writer.close)
+atexit.register(fingerprint_writer.close)
+atexit.register(prescriber_stats_writer.close)
+
+
+def record_prescription_verification(verification_data: Dict[str, Any]) -> bool:
+    """
+    Queue prescription verification results for asynchronous persistence.
+    Returns False if the results were journalled locally instead of queued.
+    """
+    document = dict(verification_data)
+    document.setdefault('timestamp', datetime.now(timezone.utc))
+    return verification_writer.submit(document)
+
+
+def record_image_fingerprint(fingerprint_data: Dict[str, Any]) -> bool:
+    """
+    Queue an image fingerprint for asynchronous insertion into the duplicate index.
+    Returns False if the fingerprint was journalled locally instead of queued.
+    """
+    document = dict(fingerprint_data)
+    document.setdefault('timestamp', datetime.now(timezone.utc))
+    return fingerprint_writer.submit(document)
+
+
+def record_prescriber_stats(license_number: str, update: Dict[str, Any]) -> bool:
+    """
+    Queue an incremental update of a doctor's prescription aggregates.
+    Returns False if the update was journalled locally instead of queued.
+    """
+    return prescriber_stats_writer.submit({'key': license_number, 'update': update})
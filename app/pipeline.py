@@ -0,0 +1,279 @@
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, List, Optional
+
+from app.utils.ocr import process_document
+from app.utils.upload import SpooledUpload
+from app.utils.verification import (
+    verify_doctor, score_prescriber, detect_tampering, grayscale_page, record_prescriber_activity,
+    TAMPER_CHECKS, CORE_TAMPER_CHECKS
+)
+from app.utils.admission import ocr_limiter, tamper_limiter, DEGRADED_OCR_MAX_SIDE
+from app.utils.image_hash import fingerprint_image, find_near_duplicates, find_exact_duplicates, sha256_digest
+from app.utils.text_index import find_similar_prescriptions, index_prescription, prescription_text_index
+from app.utils.drug_analysis import analyze_prescription
+from app.models.database import get_prescriber_stats
+from app.models.write_behind import (
+    record_prescription_verification, record_image_fingerprint,
+    verification_writer, fingerprint_writer, prescriber_stats_writer
+)
+
+# Fraud score at which tiered verification stops and rejects the prescription
+DECISION_THRESHOLD = float(os.getenv('VERIFY_DECISION_THRESHOLD', '1.0'))
+
+# Tiers in the order they run, cheapest first
+TIERS = ('exact_duplicate', 'near_duplicate', 'ocr_and_license', 'tampering', 'drug_analysis')
+
+# Fraud score contributed by each fixed-weight signal
+SIGNAL_WEIGHTS = {
+    'exact_duplicate': 1.0,
+    'near_duplicate': 0.6,
+    'license_not_found': 1.0,
+    # OCR found no license number: unreadable scans are common, so this alone
+    # sends the prescription for review without stopping verification
+    'license_missing': 0.5,
+    'license_inactive': 1.0,
+    'similar_text': 0.5,
+    'high_drug_risk': 0.3
+}
+
+# Doctor records without a status are treated as active
+ACTIVE_LICENSE_STATUSES = ('active', None)
+
+
+class Assessment:
+    """Running fraud score and the record of which tiers ran"""
+
+    def __init__(self, threshold: float, full_report: bool,
+                 on_tier: Optional[Callable[[str], None]] = None):
+        self.threshold = threshold
+        self.full_report = full_report
+        self.on_tier = on_tier
+        self.score = 0.0
+        self.signals: List[str] = []
+        self.tiers_run: List[str] = []
+        self.tier_seconds: Dict[str, float] = {}
+        self.short_circuited_after: Optional[str] = None
+        self._started = 0.0
+
+    def start(self, tier: str):
+        self.tiers_run.append(tier)
+        if self.on_tier is not None:
+            self.on_tier(tier)
+        self._started = time.perf_counter()
+
+    def finish(self, tier: str) -> bool:
+        """Close a tier; returns True if verification should stop here"""
+        self.tier_seconds[tier] = round(time.perf_counter() - self._started, 4)
+        if not self.full_report and self.score >= self.threshold and tier != TIERS[-1]:
+            self.short_circuited_after = tier
+            return True
+        return False
+
+    def add(self, signal: str, weight: Optional[float] = None):
+        self.signals.append(signal)
+        self.score += SIGNAL_WEIGHTS[signal] if weight is None else weight
+
+    def verdict(self) -> str:
+        if self.score >= self.threshold:
+            return 'reject'
+        if self.score >= self.threshold / 2:
+            return 'review'
+        return 'accept'
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'mode': 'full' if self.full_report else 'tiered',
+            'verdict': self.verdict(),
+            'fraud_score': round(self.score, 3),
+            'threshold': self.threshold,
+            'signals': self.signals,
+            'tiers_run': self.tiers_run,
+            'tiers_skipped': [tier for tier in TIERS if tier not in self.tiers_run],
+            'short_circuited_after': self.short_circuited_after,
+            'tier_seconds': self.tier_seconds
+        }
+
+
+def run_verification(upload: SpooledUpload, record: bool = True, full_report: bool = False,
+                     threshold: float = DECISION_THRESHOLD,
+                     submission_key: Optional[str] = None,
+                     on_tier: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Run the verification tiers on an upload, cheapest first.
+
+    Each tier adds to a fraud score. Unless full_report is set, verification
+    stops once the score reaches threshold, and the results of tiers that did
+    not run are None. The 'decision' entry holds the verdict and which tiers
+    ran. Returns a dict with an 'error' key if the document could not be
+    processed.
+
+    With record=False nothing is persisted: the duplicate, text and prescriber
+    indexes are queried but not updated.
+
+    submission_key identifies the source document when it can be verified more
+    than once (the batch verifier resuming after a crash); earlier records under
+    the same key are not reported as duplicates or similar prescriptions.
+
+    on_tier, if given, is called with each tier's name as it starts, so callers
+    can report progress while verification runs.
+
+    Page decoding, the near-duplicate lookup and OCR run under the OCR stage's
+    admission limit, and tamper detection under its own; both raise Overloaded
+    when their queues are full. A stage under pressure runs in
+    degraded mode, reported under 'degraded' in the results.
+    """
+    assessment = Assessment(threshold, full_report, on_tier)
+    degraded = {'active': False, 'ocr_max_side': None, 'skipped_checks': []}
+    results: Dict[str, Any] = {
+        'extracted_data': None,
+        'doctor_verification': None,
+        'tampering_detection': None,
+        'duplicate_detection': None,
+        'similar_prescriptions': None,
+        'drug_analysis': None,
+        'degraded': degraded,
+        'decision': None
+    }
+    fingerprint = None
+
+    def finish() -> Dict[str, Any]:
+        results['decision'] = assessment.report()
+        if record:
+            _record(upload, results, fingerprint, submission_key)
+        return results
+
+    # 1. Byte-identical resubmission: hash of the raw upload, one indexed lookup
+    assessment.start('exact_duplicate')
+    sha256 = sha256_digest(upload.view())
+    results['duplicate_detection'] = find_exact_duplicates(sha256, submission_key=submission_key)
+    if results['duplicate_detection']['is_duplicate']:
+        assessment.add('exact_duplicate')
+    if assessment.finish('exact_duplicate'):
+        return finish()
+
+    # Tiers 2 and 3 decode the page (rasterizing PDFs), so they run under the
+    # OCR stage's admission limit: an overloaded worker sheds the request
+    # before doing any of the expensive work
+    with ocr_limiter.slot():
+        # 2. Near-duplicate of an earlier page: decode and perceptual hash
+        assessment.start('near_duplicate')
+        try:
+            gray = grayscale_page(upload)
+        except Exception:
+            # Undecodable uploads get process_document's detailed error below
+            gray = None
+        if gray is not None:
+            fingerprint = fingerprint_image(gray, sha256)
+            if submission_key is not None:
+                fingerprint['submission_key'] = submission_key
+            results['duplicate_detection'] = find_near_duplicates(fingerprint)
+            # An exact copy is also a near-duplicate; count it once
+            if results['duplicate_detection']['is_duplicate'] and 'exact_duplicate' not in assessment.signals:
+                assessment.add('near_duplicate')
+        if assessment.finish('near_duplicate'):
+            return finish()
+
+        # 3. OCR, license verification and text similarity
+        assessment.start('ocr_and_license')
+        if ocr_limiter.under_pressure:
+            degraded.update(active=True, ocr_max_side=DEGRADED_OCR_MAX_SIDE)
+        extracted_data = process_document(upload, max_side=degraded['ocr_max_side'])
+
+    # Check if there was an error during document processing
+    if 'error' in extracted_data:
+        return extracted_data
+    results['extracted_data'] = extracted_data
+
+    doctor_verification = verify_doctor(extracted_data.get('doctor_license'))
+    results['doctor_verification'] = doctor_verification
+    if not extracted_data.get('doctor_license'):
+        assessment.add('license_missing')
+    elif not doctor_verification['is_valid']:
+        assessment.add('license_not_found')
+    elif doctor_verification['doctor_info']['license_status'] not in ACTIVE_LICENSE_STATUSES:
+        assessment.add('license_inactive')
+
+    # Look up earlier prescriptions for the same patient and date with the same text
+    results['similar_prescriptions'] = find_similar_prescriptions(
+        extracted_data.get('prescription_text'), extracted_data.get('patient_name'),
+        extracted_data.get('date'), submission_key)
+    if results['similar_prescriptions']['has_similar']:
+        assessment.add('similar_text')
+    if assessment.finish('ocr_and_license'):
+        return finish()
+
+    # 4. Tamper checks
+    assessment.start('tampering')
+    with tamper_limiter.slot():
+        checks = TAMPER_CHECKS
+        if tamper_limiter.under_pressure:
+            checks = CORE_TAMPER_CHECKS
+            degraded.update(active=True, skipped_checks=[c for c in TAMPER_CHECKS if c not in checks])
+        tampering_detection = detect_tampering(gray, checks)
+    results['tampering_detection'] = tampering_detection
+    if tampering_detection['is_tampered']:
+        assessment.add('tampering', tampering_detection['confidence'])
+    if assessment.finish('tampering'):
+        return finish()
+
+    # 5. Drug analysis and prescriber history
+    assessment.start('drug_analysis')
+    drug_analysis = analyze_prescription(extracted_data.get('prescription_text'))
+    results['drug_analysis'] = drug_analysis
+    medications = drug_analysis.get('medications', [])
+    if drug_analysis.get('risk_level') == 'high':
+        assessment.add('high_drug_risk')
+    if doctor_verification['is_valid']:
+        # One read serves both the score and the expiry of old day buckets
+        stats = get_prescriber_stats(extracted_data.get('doctor_license'))
+        anomaly = score_prescriber(extracted_data.get('doctor_license'), medications, stats)
+        doctor_verification['anomaly'] = anomaly
+        if anomaly.get('score'):
+            assessment.add('prescriber_anomaly', 0.5 * anomaly['score'])
+        if record:
+            record_prescriber_activity(extracted_data.get('doctor_license'), medications, stats)
+    assessment.finish('drug_analysis')
+
+    return finish()
+
+
+def _record(upload: SpooledUpload, results: Dict[str, Any], fingerprint: Optional[Dict[str, Any]],
+            submission_key: Optional[str]):
+    """
+    Persist the audit record, fingerprint and text index entry off the request
+    path. Only called once verification has finished, so a run that fails
+    part-way (and is retried) leaves nothing behind to match against
+    """
+    extracted_data = results['extracted_data'] or {}
+    doctor_license = extracted_data.get('doctor_license')
+    if extracted_data:
+        index_prescription(extracted_data.get('prescription_text'), {
+            'doctor_license': doctor_license,
+            'patient_name': extracted_data.get('patient_name'),
+            'date': extracted_data.get('date'),
+            'filename': upload.filename,
+            'submission_key': submission_key,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        })
+    if fingerprint is not None:
+        record_image_fingerprint({
+            **fingerprint,
+            'doctor_license': doctor_license,
+            'filename': upload.filename
+        })
+    record_prescription_verification({
+        'doctor_license': doctor_license,
+        'filename': upload.filename,
+        'submission_key': submission_key,
+        **results
+    })
+
+
+def flush_pipeline():
+    """Write out everything the pipeline still holds in memory"""
+    verification_writer.close()
+    fingerprint_writer.close()
+    prescriber_stats_writer.close()
+    prescription_text_index.sync()
@@ -0,0 +1,73 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PROCESS_STARTED = time.perf_counter()
+
+# Seconds spent in each startup stage, in the order they ran
+STARTUP_TIMINGS: Dict[str, float] = {}
+_ready_at = None
+
+
+@contextmanager
+def timed(stage: str):
+    """Record how long a startup stage takes"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[stage] = round(time.perf_counter() - started, 4)
+
+
+def warm_up():
+    """
+    Load every heavy module and model ahead of the first request.
+
+    Run this in the gunicorn master before workers fork (see gunicorn.conf.py)
+    so the loaded models are shared copy-on-write by every worker. Database
+    connections are deliberately not opened here: clients are not fork-safe
+    and each worker connects on first use.
+    """
+    with timed('import_opencv'):
+        import cv2  # noqa: F401
+    with timed('import_tesseract'):
+        from app.utils.ocr import get_tesseract
+        get_tesseract()
+    with timed('import_pdf2image'):
+        import pdf2image  # noqa: F401
+    with timed('load_spacy_model'):
+        from app.utils.drug_analysis import get_nlp
+        get_nlp()
+    with timed('load_dosage_rules'):
+        from app.utils.dosage import get_dosage_rules
+        get_dosage_rules()
+    with timed('map_reference_snapshot'):
+        from app.models.reference_snapshot import get_reference_snapshot
+        get_reference_snapshot()
+    with timed('load_text_index'):
+        from app.utils.text_index import prescription_text_index
+        prescription_text_index.sync()
+    logger.info('Warm-up finished: %s', format_timings())
+
+
+def mark_ready():
+    """Record the moment this process first became able to serve"""
+    global _ready_at
+    if _ready_at is None:
+        _ready_at = time.perf_counter()
+        STARTUP_TIMINGS.setdefault('ready', round(_ready_at - PROCESS_STARTED, 4))
+
+
+def format_timings() -> str:
+    return ', '.join(f'{stage}={seconds * 1000:.0f}ms' for stage, seconds in STARTUP_TIMINGS.items())
+
+
+def startup_report() -> Dict[str, Any]:
+    """Startup timings for this process"""
+    return {
+        'ready': _ready_at is not None,
+        'stages': dict(STARTUP_TIMINGS)
+    }
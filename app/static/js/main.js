@@ -4,6 +4,40 @@ document.addEventListener('DOMContentLoaded', () => {
     const browseButton = document.getElementById('browseButton');
     const results = document.getElementById('results');
     const loading = document.getElementById('loading');
+    const loadingMessage = document.getElementById('loadingMessage');
+    const uploadProgress = document.getElementById('uploadProgress');
+    const uploadProgressBar = document.getElementById('uploadProgressBar');
+
+    // Used until the server's own limits arrive (see /api/limits)
+    const DEFAULT_LIMITS = {
+        max_upload_bytes: 20 * 1024 * 1024,
+        max_image_side: 3500,
+        jpeg_quality: 0.92,
+        accepted_types: [
+            'application/pdf',
+            'image/jpeg',
+            'image/png',
+            'image/gif',
+            'image/bmp',
+            'image/tiff',
+            'image/webp'
+        ],
+        max_pdf_pages: 5
+    };
+    // Image types the browser can decode and re-encode before upload
+    const RESIZABLE_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/bmp'];
+    // What the server is doing in each verification tier it reports
+    const TIER_LABELS = {
+        exact_duplicate: 'Checking for resubmitted copies',
+        near_duplicate: 'Comparing with earlier prescriptions',
+        ocr_and_license: 'Reading the prescription and verifying the license',
+        tampering: 'Checking for signs of tampering',
+        drug_analysis: 'Analyzing medications'
+    };
+
+    const limitsPromise = fetch('/api/limits')
+        .then(response => response.ok ? response.json() : DEFAULT_LIMITS)
+        .catch(() => DEFAULT_LIMITS);
 
     // Drag and drop handlers
     ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
@@ -49,11 +83,12 @@ document.addEventListener('DOMContentLoaded', () => {
         handleFiles(e.target.files);
     });
 
-    function handleFiles(files) {
+    async function handleFiles(files) {
         if (files.length === 0) return;
         
         const file = files[0];
-        if (!isValidFileType(file)) {
+        const limits = await limitsPromise;
+        if (!isValidFileType(file, limits)) {
             showError('Please upload a PDF or image file (JPG, PNG)');
             return;
         }
@@ -61,40 +96,158 @@ document.addEventListener('DOMContentLoaded', () => {
         uploadFile(file);
     }
 
-    function isValidFileType(file) {
-        const validTypes = [
-            'application/pdf',
-            'image/jpeg',
-            'image/png',
-            'image/gif',
-            'image/bmp',
-            'image/tiff',
-            'image/webp'
-        ];
-        return validTypes.includes(file.type);
+    // Check against the types the server accepts, not the built-in defaults
+    function isValidFileType(file, limits) {
+        return limits.accepted_types.includes(file.type);
     }
 
-    function uploadFile(file) {
-        const formData = new FormData();
-        formData.append('file', file);
+    // Downscale large photos to the server's maximum resolution and re-encode
+    // them before upload; PDFs, small images and types the browser cannot
+    // decode are sent unchanged
+    async function prepareFile(file, limits) {
+        if (!RESIZABLE_TYPES.includes(file.type) || typeof createImageBitmap !== 'function') {
+            return file;
+        }
+
+        let bitmap;
+        try {
+            bitmap = await createImageBitmap(file, {imageOrientation: 'from-image'});
+        } catch (e) {
+            return file;
+        }
+
+        const scale = Math.min(1, limits.max_image_side / Math.max(bitmap.width, bitmap.height));
+        if (scale === 1 && file.size <= limits.max_upload_bytes) {
+            bitmap.close();
+            return file;
+        }
+
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.round(bitmap.width * scale);
+        canvas.height = Math.round(bitmap.height * scale);
+        const context = canvas.getContext('2d');
+        context.imageSmoothingQuality = 'high';
+        context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        bitmap.close();
+
+        // Scans stay lossless when that still fits; photos become high-quality JPEGs
+        let type = file.type === 'image/png' ? 'image/png' : 'image/jpeg';
+        let blob = await canvasToBlob(canvas, type, limits.jpeg_quality);
+        if (type === 'image/png' && blob.size > limits.max_upload_bytes) {
+            type = 'image/jpeg';
+            blob = await canvasToBlob(canvas, type, limits.jpeg_quality);
+        }
+        // A downscaled image is sent even if it is not smaller in bytes, so the
+        // server's maximum resolution always holds
+        if (!blob || (scale === 1 && blob.size >= file.size)) {
+            return file;
+        }
+
+        const extension = type === 'image/png' ? '.png' : '.jpg';
+        const name = file.name.replace(/\.[^.]*$/, '') + extension;
+        return new File([blob], name, {type: type});
+    }
+
+    function canvasToBlob(canvas, type, quality) {
+        return new Promise(resolve => canvas.toBlob(resolve, type, quality));
+    }
+
+    // POST with XMLHttpRequest rather than fetch to get upload progress events.
+    // With progress=1 the server streams one JSON line per verification tier
+    // as it starts, then a line with the result
+    function postFile(file) {
+        return new Promise((resolve, reject) => {
+            const formData = new FormData();
+            formData.append('file', file);
+
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', '/api/verify?progress=1');
+            let parsed = 0;
+            let result = null;
+
+            function readEvents() {
+                const text = xhr.responseText;
+                let end;
+                while ((end = text.indexOf('\n', parsed)) !== -1) {
+                    const line = text.slice(parsed, end);
+                    parsed = end + 1;
+                    let event;
+                    try {
+                        event = JSON.parse(line);
+                    } catch (e) {
+                        continue;
+                    }
+                    if (event.event === 'tier') {
+                        const label = TIER_LABELS[event.tier] || 'Analyzing prescription';
+                        showLoadingState(`${label}... (step ${event.step} of ${event.steps})`,
+                                         Math.round((event.step - 1) / event.steps * 100));
+                    } else if (event.event === 'result') {
+                        result = event;
+                    }
+                }
+            }
 
+            xhr.upload.addEventListener('progress', e => {
+                if (e.lengthComputable) {
+                    const percent = Math.round(e.loaded / e.total * 100);
+                    showLoadingState(`Uploading... ${percent}%`, percent);
+                }
+            });
+            xhr.upload.addEventListener('load', () => {
+                showLoadingState('Analyzing prescription...');
+            });
+
+            xhr.addEventListener('progress', readEvents);
+
+            xhr.addEventListener('load', () => {
+                readEvents();
+                if (result === null) {
+                    // Errors returned before streaming started (413, 400) are plain JSON
+                    let body = {};
+                    try {
+                        body = JSON.parse(xhr.responseText);
+                    } catch (e) {}
+                    result = {status: xhr.status, body: body};
+                }
+                const data = result.body || {};
+                if (result.status < 200 || result.status >= 300) {
+                    const error = new Error(data.error || data.details || 'An error occurred while processing the file');
+                    error.data = data;
+                    reject(error);
+                    return;
+                }
+                resolve(data);
+            });
+            xhr.addEventListener('error', () => reject(new Error('Network error while uploading the file')));
+            xhr.send(formData);
+        });
+    }
+
+    function showLoadingState(message, percent) {
+        loadingMessage.textContent = message;
+        if (percent === undefined) {
+            uploadProgress.classList.add('hidden');
+        } else {
+            uploadProgress.classList.remove('hidden');
+            uploadProgressBar.style.width = `${percent}%`;
+        }
+    }
+
+    async function uploadFile(file) {
         // Show loading state
         loading.classList.remove('hidden');
         results.classList.add('hidden');
-
-        fetch('/api/verify', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => {
-            if (!response.ok) {
-                return response.json().then(data => {
-                    throw new Error(data.error || data.details || 'An error occurred while processing the file');
-                });
+        showLoadingState('Preparing file...');
+
+        try {
+            const limits = await limitsPromise;
+            const prepared = await prepareFile(file, limits);
+            if (prepared.size > limits.max_upload_bytes) {
+                const megabytes = Math.floor(limits.max_upload_bytes / (1024 * 1024));
+                throw new Error(`The file is too large. Files up to ${megabytes} MB are accepted.`);
             }
-            return response.json();
-        })
-        .then(data => {
+
+            const data = await postFile(prepared);
             if (data.error) {
                 if (data.installation_guide) {
                     showInstallationGuide(data.error, data.installation_guide);
@@ -104,13 +257,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
             displayResults(data.data);
-        })
-        .catch(error => {
-            showError(error.message);
-        })
-        .finally(() => {
+        } catch (error) {
+            if (error.data && error.data.installation_guide) {
+                showInstallationGuide(error.data.error, error.data.installation_guide);
+            } else {
+                showError(error.message);
+            }
+        } finally {
             loading.classList.add('hidden');
-        });
+        }
     }
 
     function showInstallationGuide(error, guide) {
@@ -141,17 +296,48 @@ document.addEventListener('DOMContentLoaded', () => {
     function displayResults(data) {
         results.classList.remove('hidden');
 
-        // Display doctor verification results
+        // Display the overall decision
+        const decision = document.getElementById('decision');
+        decision.innerHTML = createDecisionHTML(data.decision);
+
+        // Sections of tiers skipped after an early rejection are null
         const doctorVerification = document.getElementById('doctorVerification');
-        doctorVerification.innerHTML = createDoctorVerificationHTML(data.doctor_verification);
+        doctorVerification.innerHTML = data.doctor_verification
+            ? createDoctorVerificationHTML(data.doctor_verification) : createSkippedHTML();
 
         // Display document analysis results
         const documentAnalysis = document.getElementById('documentAnalysis');
-        documentAnalysis.innerHTML = createDocumentAnalysisHTML(data.tampering_detection);
+        documentAnalysis.innerHTML = data.tampering_detection
+            ? createDocumentAnalysisHTML(data.tampering_detection) : createSkippedHTML();
 
         // Display medication analysis results
         const medicationAnalysis = document.getElementById('medicationAnalysis');
-        medicationAnalysis.innerHTML = createMedicationAnalysisHTML(data.drug_analysis);
+        medicationAnalysis.innerHTML = data.drug_analysis
+            ? createMedicationAnalysisHTML(data.drug_analysis) : createSkippedHTML();
+    }
+
+    function createDecisionHTML(decision) {
+        const verdictClass = {reject: 'text-red-600', review: 'text-yellow-600', accept: 'text-green-600'}[decision.verdict];
+        const verdictText = {reject: 'Rejected', review: 'Needs Review', accept: 'Accepted'}[decision.verdict];
+
+        return `
+            <div class="space-y-4">
+                <div class="flex items-center space-x-2">
+                    <span class="font-medium ${verdictClass}">${verdictText}</span>
+                    <span class="text-sm text-gray-500">Fraud score ${decision.fraud_score.toFixed(2)} / ${decision.threshold}</span>
+                </div>
+                ${decision.signals.length > 0 ? `
+                    <p class="text-gray-700"><span class="font-medium">Signals:</span> ${decision.signals.map(s => s.replace(/_/g, ' ')).join(', ')}</p>
+                ` : ''}
+                ${decision.short_circuited_after ? `
+                    <p class="text-sm text-gray-500">Stopped after the ${decision.short_circuited_after.replace(/_/g, ' ')} check; skipped ${decision.tiers_skipped.map(t => t.replace(/_/g, ' ')).join(', ')}.</p>
+                ` : ''}
+            </div>
+        `;
+    }
+
+    function createSkippedHTML() {
+        return '<p class="text-gray-500">Skipped: the prescription was rejected by an earlier check.</p>';
     }
 
     function createDoctorVerificationHTML(verification) {
@@ -0,0 +1,154 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any
+
+_CPUS = os.cpu_count() or 2
+
+# The gunicorn settings each process runs under (see gunicorn.conf.py); limits
+# are per process, so the host's CPUs are shared between the workers and a
+# queue can only ever hold as many requests as the worker has threads
+_WORKERS = int(os.getenv('WEB_CONCURRENCY', '4'))
+_THREADS = int(os.getenv('GUNICORN_THREADS', '4'))
+
+
+class Overloaded(Exception):
+    """Raised when a stage's queue is full or a request waited too long for a slot"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f'The {stage} stage is at capacity')
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """
+    Caps how many requests run an expensive stage at once.
+
+    Up to `max_concurrent` callers run the stage; up to `max_queue` more wait
+    for a slot for at most `queue_timeout` seconds. Anyone beyond that is
+    rejected immediately with Overloaded, so excess load is shed instead of
+    piling up behind the stage. Once `degrade_at` callers are waiting the
+    stage reports itself under pressure, and callers can switch to a cheaper
+    variant of the work.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float, degrade_at: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.degrade_at = degrade_at
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self._rejected = 0
+        # Moving average of how long one run of the stage takes
+        self._service_time = 1.0
+
+    @property
+    def under_pressure(self) -> bool:
+        return self._waiting >= self.degrade_at
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free, for the Retry-After header"""
+        backlog = (self._waiting + self._running) / self.max_concurrent
+        return max(1, math.ceil(backlog * self._service_time))
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise Overloaded(self.name, self.retry_after())
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._running,
+            'waiting': self._waiting,
+            'rejected': self._rejected,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'under_pressure': self.under_pressure,
+            'avg_service_seconds': round(self._service_time, 3)
+        }
+
+
+def _limiter(name: str) -> StageLimiter:
+    prefix = name.upper()
+    # This process's share of the CPUs, kept two below the thread count so at
+    # least one request can queue and one more can be rejected once it is full
+    default_concurrent = max(1, min(_CPUS // max(1, _WORKERS), _THREADS - 2))
+    max_concurrent = int(os.getenv(f'{prefix}_MAX_CONCURRENT', str(default_concurrent)))
+    default_queue = max(1, _THREADS - max_concurrent - 1)
+    max_queue = int(os.getenv(f'{prefix}_MAX_QUEUE', str(default_queue)))
+    return StageLimiter(
+        name,
+        max_concurrent=max_concurrent,
+        max_queue=max_queue,
+        queue_timeout=float(os.getenv(f'{prefix}_QUEUE_TIMEOUT', '10')),
+        degrade_at=int(os.getenv(f'{prefix}_DEGRADE_AT', str(max(1, max_queue // 2))))
+    )
+
+
+def check_limiter(limiter: StageLimiter, threads: int) -> Dict[str, bool]:
+    """
+    Report whether a limiter can shed load or degrade with `threads` request
+    threads in the process, and warn when it cannot
+    """
+    waiting = threads - limiter.max_concurrent
+    reachable = {
+        'queues': waiting > 0,
+        'degrades': waiting >= limiter.degrade_at,
+        'rejects': waiting > limiter.max_queue
+    }
+    if not reachable['queues']:
+        print(f"Warning: {limiter.name} admission limit ({limiter.max_concurrent}) is not below "
+              f"the {threads} request threads, so requests never wait for it")
+    elif not reachable['rejects']:
+        print(f"Warning: {limiter.name} queue ({limiter.max_queue}) holds every waiting request thread, "
+              f"so it only rejects after the {limiter.queue_timeout:g}s queue timeout")
+    return reachable
+
+
+# Per-process limits for the stages that dominate request cost
+ocr_limiter = _limiter('ocr')
+tamper_limiter = _limiter('tamper')
+
+# Page size OCR falls back to under pressure
+DEGRADED_OCR_MAX_SIDE = int(os.getenv('DEGRADED_OCR_MAX_SIDE', '1600'))
+
+
+def admission_stats() -> Dict[str, Any]:
+    return {limiter.name: limiter.stats() for limiter in (ocr_limiter, tamper_limiter)}
+
+
+def check_admission(threads: int = _THREADS) -> Dict[str, Dict[str, bool]]:
+    """Check every stage limiter against the web server's request threads"""
+    return {limiter.name: check_limiter(limiter, threads) for limiter in (ocr_limiter, tamper_limiter)}
@@ -0,0 +1,204 @@
+import csv
+import os
+import re
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+DOSAGE_RULES_PATH = os.getenv(
+    'DOSAGE_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'dosage_rules.csv')
+)
+
+# Mass units and their size in mg; ml and tablet/capsule counts are converted per drug
+MASS_UNITS_MG = {'mcg': 0.001, 'mg': 1.0, 'g': 1000.0}
+COUNT_UNITS = ('tablet', 'capsule')
+
+_UNIT = r'(mcg|mg|g|ml|tablet|capsule)s?\b'
+_NAME = r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)'
+_AMOUNT = r'(\d+(?:\.\d+)?)'
+
+# (pattern, group order) for the ways a dose is written; earlier patterns win on overlap
+MEDICATION_PATTERNS = [
+    (re.compile(r'Rx:\s*' + _NAME + r'\s*' + _AMOUNT + r'\s*' + _UNIT), ('name', 'amount', 'unit')),
+    (re.compile(_AMOUNT + r'\s*' + _UNIT + r'\s+of\s+' + _NAME), ('amount', 'unit', 'name')),
+    (re.compile(_NAME + r'\s+' + _AMOUNT + r'\s*' + _UNIT), ('name', 'amount', 'unit')),
+]
+
+# Dosing frequencies as doses per day, checked in order
+FREQUENCY_PATTERNS = [
+    (re.compile(r'\b(?:four times|4 times|4x|q\.?i\.?d\.?)(?!\w)'), 4.0),
+    (re.compile(r'\b(?:three times|3 times|3x|t\.?i\.?d\.?)(?!\w)'), 3.0),
+    (re.compile(r'\b(?:twice|two times|2 times|2x|b\.?i\.?d\.?)(?!\w)'), 2.0),
+    (re.compile(r'\b(?:every|q)\s*(\d+)\s*(?:hours?|hrs?|h)\b'), None),
+    (re.compile(r'\b(?:once|daily|nightly|at bedtime|every (?:day|morning|night)|q\.?d\.?|o\.?d\.?)(?!\w)'), 1.0),
+]
+
+
+def _number(text: str):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def parse_frequency(text: str) -> Optional[float]:
+    """Doses per day stated in the text, or None if no frequency is given"""
+    text = text.lower()
+    for pattern, per_day in FREQUENCY_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        if per_day is None:
+            hours = int(match.group(1))
+            if hours == 0:
+                continue
+            return 24.0 / hours
+        return per_day
+    return None
+
+
+def parse_medications(text: str) -> List[Dict[str, Any]]:
+    """
+    Extract medications from prescription text as
+    {'name', 'dosage': {'amount', 'unit'}, 'doses_per_day'}; doses_per_day is
+    read from the text after the dose, up to the end of the line or the next
+    medication on it, and is None when no frequency is given there
+    """
+    found: List[Tuple[Tuple[int, int], Dict[str, str]]] = []
+    for pattern, order in MEDICATION_PATTERNS:
+        for match in pattern.finditer(text):
+            span = match.span()
+            if any(span[0] < end and start < span[1] for (start, end), _ in found):
+                continue
+            found.append((span, dict(zip(order, match.groups()))))
+    found.sort(key=lambda item: item[0][0])
+
+    medications = []
+    for i, (span, fields) in enumerate(found):
+        line_end = text.find('\n', span[1])
+        end = line_end if line_end != -1 else len(text)
+        if i + 1 < len(found):
+            end = min(end, found[i + 1][0][0])
+        medications.append({
+            'name': fields['name'].strip(),
+            'dosage': {
+                'amount': _number(fields['amount']),
+                'unit': fields['unit']
+            },
+            'doses_per_day': parse_frequency(text[span[1]:end])
+        })
+    return medications
+
+
+def _limit(value: str, default: float) -> float:
+    return float(value) if value.strip() else default
+
+
+class DosageRules:
+    """
+    Per-drug dosing limits compiled into parallel numpy arrays.
+
+    Drug names are kept sorted so all of a prescription's medications are
+    matched with one np.searchsorted, and the limits are then checked with
+    array operations instead of a per-medication loop. Row `len(names)` holds the
+    default ("*") limits used for drugs without their own rule.
+    """
+
+    FIELDS = ('max_single_mg', 'max_daily_mg', 'mg_per_ml', 'max_daily_units')
+
+    def __init__(self, rows: List[Dict[str, str]]):
+        nan = float('nan')
+        default_row = next((row for row in rows if row['drug'].strip() == '*'), {})
+        defaults = {field: _limit(default_row.get(field, ''), nan) for field in self.FIELDS}
+
+        rules = {
+            row['drug'].strip().lower(): [_limit(row[field] or '', defaults[field]) for field in self.FIELDS]
+            for row in rows if row['drug'].strip() not in ('', '*')
+        }
+        self.names = np.array(sorted(rules), dtype=str)
+        table = np.array([rules[name] for name in self.names] + [[defaults[f] for f in self.FIELDS]],
+                         dtype=np.float64).reshape(-1, len(self.FIELDS))
+        self.max_single_mg, self.max_daily_mg, self.mg_per_ml, self.max_daily_units = table.T
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'DosageRules':
+        with open(path, newline='', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+        return cls(list(csv.DictReader(lines)))
+
+    def _lookup(self, names: List[str]) -> np.ndarray:
+        """Rule row per drug name: the full name, else its first or last word, else the default row"""
+        n = len(self.names)
+        if n == 0:
+            return np.zeros(len(names), dtype=np.intp)
+
+        def find(queries: np.ndarray) -> np.ndarray:
+            idx = np.searchsorted(self.names, queries)
+            clipped = np.minimum(idx, n - 1)
+            return np.where((idx < n) & (self.names[clipped] == queries), clipped, n)
+
+        words = [name.lower().split() or [''] for name in names]
+        idx = find(np.array([' '.join(w) for w in words], dtype=str))
+        idx = np.where(idx == n, find(np.array([w[0] for w in words], dtype=str)), idx)
+        return np.where(idx == n, find(np.array([w[-1] for w in words], dtype=str)), idx)
+
+    def check(self, medications: List[Dict[str, Any]]) -> List[str]:
+        """Dosage warnings for a prescription, evaluated in one pass over its medications"""
+        meds = [
+            med for med in medications
+            if isinstance(med.get('dosage'), dict) and med['dosage'].get('amount') is not None
+        ]
+        if not meds:
+            return []
+
+        rule = self._lookup([med['name'] for med in meds])
+        amount = np.array([float(med['dosage']['amount']) for med in meds])
+        units = [med['dosage'].get('unit') for med in meds]
+        per_day = np.array([med.get('doses_per_day') or np.nan for med in meds], dtype=np.float64)
+
+        mass_factor = np.array([MASS_UNITS_MG.get(unit, np.nan) for unit in units])
+        is_ml = np.array([unit == 'ml' for unit in units])
+        is_count = np.array([unit in COUNT_UNITS for unit in units])
+
+        # A dose with no stated frequency is taken at least once a day
+        daily_factor = np.where(np.isnan(per_day), 1.0, per_day)
+        dose_mg = np.where(is_ml, amount * self.mg_per_ml[rule], amount * mass_factor)
+        daily_mg = dose_mg * daily_factor
+        daily_units = np.where(is_count, amount * daily_factor, np.nan)
+
+        # Comparisons with NaN (unknown conversion or no limit) are False
+        with np.errstate(invalid='ignore'):
+            single_over = dose_mg > self.max_single_mg[rule]
+            daily_over = ~single_over & (daily_mg > self.max_daily_mg[rule])
+            units_over = daily_units > self.max_daily_units[rule]
+
+        warnings = []
+        for j in np.flatnonzero(single_over | daily_over | units_over):
+            med, r = meds[j], rule[j]
+            written = f"{med['dosage']['amount']}{med['dosage']['unit']}"
+            if single_over[j]:
+                message = (f"High dosage detected for {med['name']}: {written} "
+                           f"({dose_mg[j]:g} mg per dose, limit {self.max_single_mg[r]:g} mg)")
+            elif daily_over[j]:
+                message = (f"High daily dosage detected for {med['name']}: {written} "
+                           f"({daily_mg[j]:g} mg per day, limit {self.max_daily_mg[r]:g} mg)")
+            else:
+                message = (f"High daily dosage detected for {med['name']}: {written} "
+                           f"({daily_units[j]:g} {med['dosage']['unit']}s per day, "
+                           f"limit {self.max_daily_units[r]:g})")
+            warnings.append(message)
+        return warnings
+
+
+_rules: Optional[DosageRules] = None
+_rules_lock = threading.Lock()
+
+
+def get_dosage_rules() -> DosageRules:
+    """Load the dosage rule table on first use and reuse it afterwards"""
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = DosageRules.from_csv(DOSAGE_RULES_PATH)
+    return _rules
@@ -1,15 +1,22 @@
-import spacy
 from typing import Dict, Any, List
 import re
 from app.models.database import get_drug_interactions, get_drug_contraindications
+from app.utils.dosage import parse_medications, get_dosage_rules
 
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Downloading spaCy model...")
-    spacy.cli.download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
+_nlp = None
+
+def get_nlp():
+    """Load the spaCy model on first use and reuse it afterwards"""
+    global _nlp
+    if _nlp is None:
+        import spacy
+        try:
+            _nlp = spacy.load("en_core_web_sm")
+        except OSError:
+            print("Downloading spaCy model...")
+            spacy.cli.download("en_core_web_sm")
+            _nlp = spacy.load("en_core_web_sm")
+    return _nlp
 
 def analyze_prescription(text: str) -> Dict[str, Any]:
     """
@@ -22,7 +29,7 @@ def analyze_prescription(text: str) -> Dict[str, Any]:
         }
     
     # Process text with spaCy
-    doc = nlp(text)
+    doc = get_nlp()(text)
     
     # Extract medications and dosages
     medications = extract_medications(doc)
@@ -53,7 +60,8 @@ def analyze_prescription(text: str) -> Dict[str, Any]:
     unusual_dosages = check_unusual_dosages(medications)
     if unusual_dosages:
         analysis['warnings'].extend(unusual_dosages)
-        analysis['risk_level'] = 'medium'
+        if analysis['risk_level'] == 'low':
+            analysis['risk_level'] = 'medium'
     
     # Check for missing information
     missing_info = check_missing_information(doc)
@@ -66,33 +74,7 @@ def analyze_prescription(text: str) -> Dict[str, Any]:
 
 def extract_medications(doc) -> List[Dict[str, Any]]:
     """Extract medications and their dosages from the prescription text"""
-    medications = []
-    
-    # Common medication patterns
-    patterns = [
-        r'(\d+)\s*(mg|g|ml|tablet|capsule)s?\s+of\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)',
-        r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+(\d+)\s*(mg|g|ml|tablet|capsule)s?',
-        r'Rx:\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(\d+)\s*(mg|g|ml|tablet|capsule)s?'
-    ]
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, doc.text)
-        for match in matches:
-            if len(match.groups()) == 3:
-                if pattern.startswith('Rx:'):
-                    name, amount, unit = match.groups()
-                else:
-                    amount, unit, name = match.groups()
-                
-                medications.append({
-                    'name': name.strip(),
-                    'dosage': {
-                        'amount': int(amount),
-                        'unit': unit
-                    }
-                })
-    
-    return medications
+    return parse_medications(doc.text)
 
 def check_drug_interactions(medications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Check for potential drug interactions"""
@@ -143,19 +125,8 @@ def check_contraindications(medications: List[Dict[str, Any]]) -> List[Dict[str,
     return contraindications
 
 def check_unusual_dosages(medications: List[Dict[str, Any]]) -> List[str]:
-    """Check for unusual medication dosages"""
-    warnings = []
-    
-    for medication in medications:
-        # Example thresholds (should be replaced with actual medical guidelines)
-        if medication['dosage']['unit'] == 'mg':
-            if medication['dosage']['amount'] > 1000:
-                warnings.append(f"High dosage detected for {medication['name']}: {medication['dosage']['amount']}mg")
-        elif medication['dosage']['unit'] == 'g':
-            if medication['dosage']['amount'] > 2:
-                warnings.append(f"High dosage detected for {medication['name']}: {medication['dosage']['amount']}g")
-    
-    return warnings
+    """Check medication dosages against the per-drug limits in the dosage rule table"""
+    return get_dosage_rules().check(medications)
 
 def check_missing_information(doc) -> List[str]:
     """Check for missing important information in the prescription"""
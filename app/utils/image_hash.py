@@ -0,0 +1,163 @@
+import hashlib
+import os
+from itertools import combinations
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from app.models.database import (
+    find_near_image_fingerprints, iter_image_fingerprints, find_image_fingerprints_by_sha256
+)
+
+# Maximum pHash Hamming distance reported as a near-duplicate
+IMAGE_MATCH_DISTANCE = int(os.getenv('IMAGE_MATCH_DISTANCE', '6'))
+
+HASH_BITS = 64
+BLOCK_COUNT = 4
+BLOCK_BITS = HASH_BITS // BLOCK_COUNT
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+
+def phash(gray: np.ndarray) -> int:
+    """64-bit DCT perceptual hash of a grayscale image"""
+    import cv2
+    resized = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(resized)[:8, :8].flatten()
+    # Median excludes the DC term, which only encodes overall brightness
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash of a grayscale image"""
+    import cv2
+    resized = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int((resized[:, 1:] > resized[:, :-1]).flatten())
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def to_signed64(value: int) -> int:
+    """Map an unsigned 64-bit hash onto MongoDB's signed int64 range"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned64(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def hash_blocks(value: int) -> List[int]:
+    """
+    Split a hash into BLOCK_COUNT blocks, each tagged with its position
+    so all blocks can share a single multikey index
+    """
+    return [
+        (i << BLOCK_BITS) | ((value >> (i * BLOCK_BITS)) & BLOCK_MASK)
+        for i in range(BLOCK_COUNT)
+    ]
+
+
+def probe_blocks(value: int, max_distance: int) -> List[int]:
+    """
+    Index keys to probe for hashes within max_distance of value.
+
+    By the pigeonhole principle, any hash within distance r differs from the
+    query by at most r // BLOCK_COUNT bits in at least one block, so probing
+    every block value within that radius finds all matches.
+    """
+    radius = max_distance // BLOCK_COUNT
+    keys = []
+    for key in hash_blocks(value):
+        keys.append(key)
+        for flips in range(1, radius + 1):
+            for positions in combinations(range(BLOCK_BITS), flips):
+                flipped = key
+                for position in positions:
+                    flipped ^= 1 << position
+                keys.append(flipped)
+    return keys
+
+
+def sha256_digest(raw: memoryview) -> str:
+    """Exact fingerprint of the uploaded bytes"""
+    return hashlib.sha256(raw).hexdigest()
+
+
+def fingerprint_image(gray: np.ndarray, sha256: str) -> Dict[str, Any]:
+    """Compute the perceptual fingerprints of a processed page"""
+    p = phash(gray)
+    return {
+        'phash': to_signed64(p),
+        'dhash': to_signed64(dhash(gray)),
+        'phash_blocks': hash_blocks(p),
+        'sha256': sha256
+    }
+
+
+def find_exact_duplicates(sha256: str, limit: int = 10, submission_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Look up earlier submissions with byte-identical uploads; needs no decoding,
+    so it runs before any of the image work. Records of the same submission_key
+    are the same document processed again and are not reported
+    """
+    matches = [{
+        'submission_id': str(candidate['_id']),
+        'filename': candidate.get('filename'),
+        'doctor_license': candidate.get('doctor_license'),
+        'timestamp': candidate['timestamp'].isoformat() if candidate.get('timestamp') else None,
+        'distance': 0,
+        'dhash_distance': 0,
+        'exact_copy': True
+    } for candidate in find_image_fingerprints_by_sha256(sha256, limit, exclude_key=submission_key)]
+    return {
+        'is_duplicate': bool(matches),
+        'phash': None,
+        'matches': matches
+    }
+
+
+def find_near_duplicates(fingerprint: Dict[str, Any],
+                         max_distance: int = IMAGE_MATCH_DISTANCE,
+                         limit: int = 10) -> Dict[str, Any]:
+    """
+    Look up earlier submissions whose pHash is within max_distance of this page,
+    skipping records of the fingerprint's own submission_key
+    """
+    query = to_unsigned64(fingerprint['phash'])
+    query_dhash = to_unsigned64(fingerprint['dhash'])
+    submission_key = fingerprint.get('submission_key')
+    keys = probe_blocks(query, max_distance)
+
+    # All probe keys go in one query, and the distance filter runs before the
+    # limit, so common blocks cannot crowd out true matches
+    candidates = find_near_image_fingerprints(keys, fingerprint['phash'], fingerprint['dhash'],
+                                              max_distance, limit, exclude_key=submission_key)
+    if candidates is None:
+        candidates = []
+        for candidate in iter_image_fingerprints(keys, exclude_key=submission_key):
+            distance = hamming_distance(query, to_unsigned64(candidate['phash']))
+            if distance <= max_distance:
+                candidate['distance'] = distance
+                candidate['dhash_distance'] = hamming_distance(query_dhash, to_unsigned64(candidate['dhash']))
+                candidates.append(candidate)
+        candidates.sort(key=lambda candidate: (candidate['distance'], candidate['dhash_distance']))
+
+    matches = [{
+        'submission_id': str(candidate['_id']),
+        'filename': candidate.get('filename'),
+        'doctor_license': candidate.get('doctor_license'),
+        'timestamp': candidate['timestamp'].isoformat() if candidate.get('timestamp') else None,
+        'distance': candidate['distance'],
+        'dhash_distance': candidate['dhash_distance'],
+        'exact_copy': candidate.get('sha256') == fingerprint['sha256']
+    } for candidate in candidates[:limit]]
+    return {
+        'is_duplicate': bool(matches),
+        'phash': f"{query:016x}",
+        'matches': matches
+    }
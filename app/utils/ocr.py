@@ -1,35 +1,33 @@
-import pytesseract
-from PIL import Image
-import pdf2image
-import io
 import re
-from typing import Dict, Any
-import os
+from typing import Dict, Any, Optional
 import sys
+from app.utils.upload import SpooledUpload, MAX_PDF_PAGES
+from app.utils.dosage import parse_medications
 
-# Configure Tesseract path
-if sys.platform.startswith('win'):
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+def get_tesseract():
+    """Import and configure pytesseract on first use"""
+    import pytesseract
+    # Configure Tesseract path
+    if sys.platform.startswith('win'):
+        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+    return pytesseract
 
-def process_document(file) -> Dict[str, Any]:
+def process_document(upload: SpooledUpload, max_side: Optional[int] = None) -> Dict[str, Any]:
     """
-    Process uploaded document (image or PDF) and extract text using OCR
+    Process uploaded document (image or PDF) and extract text using OCR.
+    If max_side is given, larger pages are downscaled to it before OCR.
     """
     try:
-        # Save file content to bytes buffer
-        file_content = file.read()
-        file.seek(0)  # Reset file pointer for future reads
-        
         # Convert PDF to image if necessary
-        if file.filename.lower().endswith('.pdf'):
+        if upload.is_pdf:
             try:
-                images = pdf2image.convert_from_bytes(file_content)
-                if not images:
+                page_count = upload.page_count()
+                if page_count > MAX_PDF_PAGES:
                     return {
-                        'error': 'Could not extract any pages from the PDF.',
-                        'details': 'Please ensure the PDF is not corrupted and contains at least one page.'
+                        'error': f'PDF has {page_count} pages; at most {MAX_PDF_PAGES} are accepted.',
+                        'details': 'Please upload only the pages containing the prescription.'
                     }
-                image = images[0]  # Process first page
+                image = upload.first_page()  # Process first page
             except Exception as e:
                 if "poppler" in str(e).lower():
                     return {
@@ -42,19 +40,22 @@ def process_document(file) -> Dict[str, Any]:
                 }
         else:
             try:
-                image = Image.open(io.BytesIO(file_content))
-                # Convert image to RGB if it's in a different mode (e.g., RGBA, CMYK)
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
+                # Decoded once and converted to RGB; shared with tamper detection
+                image = upload.first_page()
             except Exception as e:
                 return {
                     'error': f'Error opening image: {str(e)}',
                     'details': 'Please ensure the file is a valid image format (JPG, PNG, GIF, BMP, TIFF, WEBP) or PDF.'
                 }
 
+        if max_side and max(image.size) > max_side:
+            # Shrink a copy; the full-resolution page is still used for tamper checks
+            image = image.copy()
+            image.thumbnail((max_side, max_side))
+
         # Perform OCR
         try:
-            text = pytesseract.image_to_string(image)
+            text = get_tesseract().image_to_string(image)
             if not text.strip():
                 return {
                     'error': 'No text could be extracted from the image.',
@@ -150,21 +151,14 @@ def extract_patient_name(text: str) -> str:
     return ""
 
 def extract_medications(text: str) -> list:
-    """Extract prescribed medications"""
-    # Look for common medication patterns
+    """Extract prescribed medications, in the same format as drug_analysis"""
     medications = []
     lines = text.split('\n')
     
     for line in lines:
         # Look for common medication indicators
         if any(indicator in line.lower() for indicator in ['rx', 'prescribe', 'medication', 'drug']):
-            # Extract medication name and dosage
-            med_match = re.search(r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(\d+\s*(?:mg|g|ml|tablet|capsule)s?)', line)
-            if med_match:
-                medications.append({
-                    'name': med_match.group(1),
-                    'dosage': med_match.group(2)
-                })
+            medications.extend(parse_medications(line))
     
     return medications
 
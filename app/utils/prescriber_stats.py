@@ -0,0 +1,165 @@
+import math
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from app.utils.dosage import MASS_UNITS_MG
+
+# Prescriber statistics settings (overridable through the environment)
+STATS_WINDOW_DAYS = int(os.getenv('PRESCRIBER_STATS_WINDOW_DAYS', '30'))
+STATS_MIN_HISTORY = int(os.getenv('PRESCRIBER_STATS_MIN_HISTORY', '20'))
+
+# Count-min sketch dimensions for per-prescriber drug frequencies
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 512
+
+# Schedule II-IV substances commonly targeted by forged prescriptions
+CONTROLLED_SUBSTANCES = {
+    'oxycodone', 'hydrocodone', 'morphine', 'fentanyl', 'hydromorphone', 'methadone',
+    'codeine', 'tramadol', 'tapentadol', 'buprenorphine', 'oxymorphone',
+    'alprazolam', 'diazepam', 'lorazepam', 'clonazepam', 'temazepam',
+    'zolpidem', 'amphetamine', 'dextroamphetamine', 'lisdexamfetamine',
+    'methylphenidate', 'adderall', 'ritalin', 'percocet', 'vicodin',
+    'xanax', 'valium', 'ativan', 'klonopin', 'ambien', 'pregabalin', 'carisoprodol'
+}
+
+
+def is_controlled(drug_name: str) -> bool:
+    return any(word in CONTROLLED_SUBSTANCES for word in drug_name.lower().split())
+
+
+def dosage_in_mg(medication: Dict[str, Any]) -> Optional[float]:
+    """Return a medication's dose in mg, or None for units without a mass"""
+    dosage = medication.get('dosage')
+    if not isinstance(dosage, dict) or dosage.get('unit') not in MASS_UNITS_MG:
+        return None
+    return float(dosage['amount']) * MASS_UNITS_MG[dosage['unit']]
+
+
+def sketch_cells(drug_name: str) -> List[str]:
+    """Count-min sketch cell keys for a drug, one per row"""
+    name = drug_name.strip().lower()
+    return [f'{row}_{zlib.crc32(f"{row}:{name}".encode()) % SKETCH_WIDTH}' for row in range(SKETCH_DEPTH)]
+
+
+def _day_key(day: datetime) -> str:
+    return day.strftime('%Y%m%d')
+
+
+def build_stats_update(medications: List[Dict[str, Any]], stats: Optional[Dict[str, Any]] = None,
+                       now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    MongoDB update recording one prescription in a prescriber's aggregates.
+    Every field is maintained with $inc, so the update is O(1) and safe to
+    apply concurrently from any number of workers. Given the prescriber's
+    current aggregates, the update also removes every day bucket that has
+    left the window, however long the prescriber was idle.
+    """
+    now = now or datetime.now(timezone.utc)
+    inc: Dict[str, Any] = {'total': 1, f'daily.{_day_key(now)}': 1}
+
+    if any(is_controlled(med['name']) for med in medications):
+        inc['controlled'] = 1
+
+    for med in medications:
+        inc['drug_total'] = inc.get('drug_total', 0) + 1
+        for cell in sketch_cells(med['name']):
+            inc[f'sketch.{cell}'] = inc.get(f'sketch.{cell}', 0) + 1
+        dose = dosage_in_mg(med)
+        if dose is not None:
+            inc['dose_count'] = inc.get('dose_count', 0) + 1
+            inc['dose_sum'] = inc.get('dose_sum', 0.0) + dose
+            inc['dose_sumsq'] = inc.get('dose_sumsq', 0.0) + dose * dose
+
+    # Drop the day buckets outside the window, which anomaly_score reads as days
+    # 0..STATS_WINDOW_DAYS back. Only today's bucket is ever incremented, so
+    # removing buckets seen in a slightly stale read is safe
+    cutoff = _day_key(now - timedelta(days=STATS_WINDOW_DAYS))
+    update = {'$inc': inc, '$set': {'last_seen': now}}
+    expired = {f'daily.{day}': '' for day in (stats or {}).get('daily', {}) if day < cutoff}
+    if expired:
+        update['$unset'] = expired
+    return update
+
+
+def _drug_frequency(stats: Dict[str, Any], drug_name: str) -> float:
+    sketch = stats.get('sketch', {})
+    estimate = min(sketch.get(cell, 0) for cell in sketch_cells(drug_name))
+    return estimate / max(stats.get('drug_total', 0), 1)
+
+
+def anomaly_score(stats: Optional[Dict[str, Any]], medications: List[Dict[str, Any]],
+                  now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Score how unusual a prescription is for its prescriber, in [0, 1],
+    from the aggregates alone (no raw history is read)
+    """
+    if not stats or stats.get('total', 0) < STATS_MIN_HISTORY:
+        return {
+            'score': None,
+            'factors': [],
+            'message': 'Not enough prescription history for this license'
+        }
+
+    now = now or datetime.now(timezone.utc)
+    total = stats['total']
+    factors = []
+    components = []
+
+    # 1. Today's volume against the prescriber's daily volume over the window
+    daily = stats.get('daily', {})
+    today = daily.get(_day_key(now), 0) + 1
+    history = [
+        daily.get(_day_key(now - timedelta(days=d)), 0)
+        for d in range(1, STATS_WINDOW_DAYS + 1)
+    ]
+    mean = sum(history) / len(history)
+    std = math.sqrt(sum((v - mean) ** 2 for v in history) / len(history))
+    volume_z = (today - mean) / (std + 1.0)
+    volume_component = min(max(volume_z / 4.0, 0.0), 1.0)
+    components.append(volume_component)
+    if volume_component > 0.5:
+        factors.append(f'Daily volume {today} against an average of {mean:.1f}')
+
+    # 2. Controlled substances from a prescriber who rarely prescribes them
+    controlled_share = stats.get('controlled', 0) / total
+    if any(is_controlled(med['name']) for med in medications):
+        controlled_component = 1.0 - min(controlled_share / 0.2, 1.0)
+        if controlled_component > 0.5:
+            factors.append(f'Controlled substance from a prescriber with {controlled_share:.0%} controlled share')
+    else:
+        controlled_component = 0.0
+    components.append(controlled_component)
+
+    # 3. Drugs this prescriber has (almost) never prescribed
+    if medications:
+        novel = [med['name'] for med in medications if _drug_frequency(stats, med['name']) < 0.01]
+        novelty_component = len(novel) / len(medications)
+        if novel:
+            factors.append(f"Unusual drugs for this prescriber: {', '.join(novel)}")
+    else:
+        novelty_component = 0.0
+    components.append(novelty_component)
+
+    # 4. Doses far above the prescriber's running dose statistics
+    dose_count = stats.get('dose_count', 0)
+    dosage_component = 0.0
+    if dose_count >= 2:
+        dose_mean = stats['dose_sum'] / dose_count
+        dose_var = max(stats['dose_sumsq'] / dose_count - dose_mean ** 2, 0.0)
+        dose_std = math.sqrt(dose_var) or 1.0
+        for med in medications:
+            dose = dosage_in_mg(med)
+            if dose is None:
+                continue
+            z = (dose - dose_mean) / dose_std
+            if z > 3:
+                factors.append(f"{med['name']} dose {dose:g} mg is {z:.1f} standard deviations above this prescriber's mean")
+            dosage_component = max(dosage_component, min(max(z / 6.0, 0.0), 1.0))
+    components.append(dosage_component)
+
+    return {
+        'score': round(max(components) * 0.6 + sum(components) / len(components) * 0.4, 3),
+        'factors': factors
+    }
@@ -0,0 +1,231 @@
+import atexit
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+# Text index settings (overridable through the environment). The log holds
+# patient names, so it defaults to var/ in the project rather than the working
+# directory, and is only readable by its owner
+TEXT_INDEX_PATH = os.getenv(
+    'TEXT_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                 'var', 'prescription_text_index.jsonl')
+)
+TEXT_INDEX_SYNC_INTERVAL = float(os.getenv('TEXT_INDEX_SYNC_INTERVAL', '5.0'))
+TEXT_MATCH_THRESHOLD = float(os.getenv('TEXT_MATCH_THRESHOLD', '0.6'))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+
+# Largest prime below 2**32, so (a * x + b) stays within uint64 and signatures fit uint32
+PRIME = 4294967291
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and reduce OCR text to single-spaced alphanumeric words"""
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split())
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """CRC32 hashes of the character shingles of normalized text"""
+    normalized = normalize_text(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized} if normalized else set()
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """NUM_PERM-value MinHash signature of the text, or None if it has no content"""
+    hashes = shingle_hashes(text)
+    if hashes.size == 0:
+        return None
+    hashes %= PRIME
+    # One row per permutation, reduced over all shingles in a single pass
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def _band_keys(signature: np.ndarray) -> List[int]:
+    return [
+        int.from_bytes(hashlib.blake2b(signature[b * ROWS:(b + 1) * ROWS].tobytes(), digest_size=8).digest(), 'big')
+        for b in range(BANDS)
+    ]
+
+
+class MinHashLSHIndex:
+    """
+    In-process MinHash LSH index over prescription text.
+
+    Signatures are split into BANDS bands of ROWS values; prescriptions that
+    agree on every value of any one band share a bucket and become candidates,
+    which are then ranked by estimated Jaccard similarity. Inserts are appended
+    to a JSONL log that every process sharing the path tails on each sync, so
+    the index survives restarts and picks up other workers' inserts.
+    """
+
+    def __init__(self, path: Optional[str] = TEXT_INDEX_PATH,
+                 sync_interval: float = TEXT_INDEX_SYNC_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        self._buckets: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(BANDS)]
+        self._signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._count = 0
+        self._entries: List[Dict[str, Any]] = []
+        self._ids = set()
+        self._pending: List[str] = []
+        self._offset = 0
+        self._last_sync = None
+        self._secured = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _add(self, entry_id: str, signature: np.ndarray, metadata: Dict[str, Any]):
+        if entry_id in self._ids:
+            return
+        if self._count == len(self._signatures):
+            grown = np.empty((max(1024, 2 * self._count), NUM_PERM), dtype=np.uint32)
+            grown[:self._count] = self._signatures[:self._count]
+            self._signatures = grown
+        position = self._count
+        self._signatures[position] = signature
+        self._count += 1
+        self._entries.append(metadata)
+        self._ids.add(entry_id)
+        for band, key in enumerate(_band_keys(signature)):
+            self._buckets[band][key].append(position)
+
+    def insert(self, signature: np.ndarray, metadata: Dict[str, Any]) -> str:
+        """Add a signature to the index; it is persisted on the next sync"""
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._add(entry_id, signature, metadata)
+            if self.path:
+                self._pending.append(json.dumps({
+                    'id': entry_id,
+                    'signature': base64.b64encode(signature.tobytes()).decode(),
+                    'metadata': metadata
+                }))
+        self._maybe_sync()
+        return entry_id
+
+    def query(self, signature: np.ndarray, threshold: float = TEXT_MATCH_THRESHOLD,
+              limit: Optional[int] = 10) -> List[Dict[str, Any]]:
+        """Prior entries whose estimated Jaccard similarity is at least threshold (all of them if limit is None)"""
+        self._maybe_sync()
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(_band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+            if not candidates:
+                return []
+            positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarities = (self._signatures[positions] == signature).mean(axis=1)
+            entries = [self._entries[p] for p in positions]
+
+        order = np.argsort(-similarities)
+        results = []
+        for i in order[:limit]:
+            if similarities[i] < threshold:
+                break
+            results.append({**entries[i], 'similarity': round(float(similarities[i]), 3)})
+        return results
+
+    def _maybe_sync(self):
+        # The log is first loaded on first use rather than at import
+        if self.path and (self._last_sync is None or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """Append pending inserts to the log and load entries added by other processes"""
+        if not self.path:
+            return
+        with self._lock:
+            if self._pending:
+                data = ''.join(line + '\n' for line in self._pending).encode()
+                if not self._secured:
+                    os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    if not self._secured:
+                        # Also tightens a log created by an earlier version
+                        os.chmod(self.path, 0o600)
+                        self._secured = True
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+                self._pending = []
+
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as log:
+                    log.seek(self._offset)
+                    data = log.read()
+                # Leave a partially written trailing line for the next sync
+                end = data.rfind(b'\n') + 1
+                for line in data[:end].splitlines():
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    signature = np.frombuffer(base64.b64decode(record['signature']), dtype=np.uint32)
+                    self._add(record['id'], signature, record['metadata'])
+                self._offset += end
+            self._last_sync = time.monotonic()
+
+
+prescription_text_index = MinHashLSHIndex()
+atexit.register(prescription_text_index.sync)
+
+
+def _same_field(a: Optional[str], b: Optional[str]) -> bool:
+    return bool(a and b) and normalize_text(a) == normalize_text(b)
+
+
+def find_similar_prescriptions(text: str, patient_name: Optional[str] = None, date: Optional[str] = None,
+                               submission_key: Optional[str] = None, limit: int = 10) -> Dict[str, Any]:
+    """
+    Find earlier prescriptions for the same patient and date with near-identical
+    text. Prescriptions written on one letterhead share most of their text, so
+    text similarity alone would match every repeat prescription of a clinic; a
+    match is only reported once the extracted patient name and date agree as
+    well, and nothing is reported when OCR found neither. Entries recorded under
+    the same submission_key are the same document processed again and are not
+    reported
+    """
+    signature = minhash(text or '')
+    if signature is None or not (patient_name and date):
+        return {'has_similar': False, 'matches': []}
+
+    matches = [
+        match for match in prescription_text_index.query(signature, limit=None)
+        if _same_field(match.get('patient_name'), patient_name) and _same_field(match.get('date'), date)
+        and (submission_key is None or match.get('submission_key') != submission_key)
+    ][:limit]
+    return {
+        'has_similar': bool(matches),
+        'matches': matches
+    }
+
+
+def index_prescription(text: str, metadata: Dict[str, Any]):
+    """Add a verified prescription's text to the index so later submissions match it"""
+    signature = minhash(text or '')
+    if signature is not None:
+        prescription_text_index.insert(signature, metadata)
@@ -0,0 +1,206 @@
+import io
+import mmap
+import os
+import tempfile
+import warnings
+from typing import Dict, Any, Optional, List
+
+from PIL import Image
+
+# Upload limits (overridable through the environment)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+SPOOL_MEMORY_BYTES = int(os.getenv('UPLOAD_SPOOL_MEMORY_KB', '1024')) * 1024
+MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '5'))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', '50000000'))
+
+# Browser clients downscale photos to this longest side (about A4 at 300 dpi) and
+# re-encode them at this JPEG quality, which stays above the 90 the ELA check uses
+CLIENT_MAX_IMAGE_SIDE = int(os.getenv('CLIENT_MAX_IMAGE_SIDE', '3500'))
+CLIENT_JPEG_QUALITY = float(os.getenv('CLIENT_JPEG_QUALITY', '0.92'))
+ACCEPTED_TYPES = (
+    'application/pdf', 'image/jpeg', 'image/png', 'image/gif',
+    'image/bmp', 'image/tiff', 'image/webp'
+)
+
+CHUNK_SIZE = 64 * 1024
+
+# Refuse decompression bombs before they reach OpenCV or Tesseract. Pillow only
+# warns between the limit and twice the limit, so that warning is raised as well
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+def client_limits() -> Dict[str, Any]:
+    """Upload limits advertised to clients so they can prepare files before sending"""
+    return {
+        'max_upload_bytes': MAX_UPLOAD_BYTES,
+        'max_image_side': CLIENT_MAX_IMAGE_SIDE,
+        'jpeg_quality': CLIENT_JPEG_QUALITY,
+        'accepted_types': list(ACCEPTED_TYPES),
+        'max_pdf_pages': MAX_PDF_PAGES
+    }
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+    def __init__(self, limit: int):
+        super().__init__(f'Upload exceeds the {limit // (1024 * 1024)} MB limit')
+        self.limit = limit
+
+
+class SpooledUpload:
+    """
+    Upload bytes kept in memory below a threshold and in a temporary file above it.
+
+    Downstream stages read the bytes through `view()` (a read-only memoryview
+    backed by the in-memory buffer or an mmap of the spool file) or `open()`
+    (a rewound file object), so the upload is never copied again once ingested.
+    """
+
+    def __init__(self, filename: str = '', max_bytes: int = MAX_UPLOAD_BYTES,
+                 max_memory: int = SPOOL_MEMORY_BYTES):
+        self.filename = filename or ''
+        self.size = 0
+        self._max_bytes = max_bytes
+        self._max_memory = max_memory
+        self._file = io.BytesIO()
+        self._path: Optional[str] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._views: List[memoryview] = []
+        self._page = None
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.filename.lower().endswith('.pdf')
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path of the spool file, or None while the upload is held in memory"""
+        return self._path
+
+    def write(self, chunk: bytes) -> int:
+        if self.size + len(chunk) > self._max_bytes:
+            raise UploadTooLarge(self._max_bytes)
+        if self._path is None and self.size + len(chunk) > self._max_memory:
+            self._rollover()
+        self._file.write(chunk)
+        self.size += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def _rollover(self):
+        """Move the buffered bytes to a named temporary file"""
+        suffix = os.path.splitext(self.filename)[1]
+        spool = tempfile.NamedTemporaryFile(prefix='upload-', suffix=suffix)
+        spool.write(self._file.getbuffer())
+        self._file.close()
+        self._file = spool
+        self._path = spool.name
+
+    def view(self) -> memoryview:
+        """Return a read-only, zero-copy view of the upload bytes"""
+        if self._path is None:
+            view = self._file.getbuffer()
+            self._views.append(view)
+            view = view.toreadonly()
+        elif self.size == 0:
+            view = memoryview(b'')
+        else:
+            view = memoryview(self._mapped())
+        self._views.append(view)
+        return view
+
+    def open(self):
+        """Return a file object positioned at the start of the upload"""
+        fp = self._mapped() if self._path is not None and self.size else self._file
+        fp.seek(0)
+        return fp
+
+    def _mapped(self) -> mmap.mmap:
+        if self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def first_page(self) -> Image.Image:
+        """
+        Decode the first page of the upload as an RGB image.
+        The result is cached so OCR and tamper detection share one decode.
+        """
+        if self._page is None:
+            if self.is_pdf:
+                import pdf2image
+                if self._path is not None:
+                    pages = pdf2image.convert_from_path(self._path, first_page=1, last_page=1)
+                else:
+                    # Poppler reads files, so pdf2image writes in-memory bytes to a temporary file
+                    pages = pdf2image.convert_from_bytes(self.view(), first_page=1, last_page=1)
+                if not pages:
+                    raise ValueError('Could not extract any pages from the PDF.')
+                image = pages[0]
+            else:
+                image = Image.open(self.open())
+                image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            self._page = image
+        return self._page
+
+    def page_count(self) -> int:
+        """Return the number of pages in the upload (1 for images)"""
+        if not self.is_pdf:
+            return 1
+        import pdf2image
+        if self._path is not None:
+            info = pdf2image.pdfinfo_from_path(self._path)
+        else:
+            info = pdf2image.pdfinfo_from_bytes(self.view())
+        return int(info.get('Pages', 0))
+
+    def close(self):
+        self._page = None
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def spool_upload(stream, filename: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                 max_memory: int = SPOOL_MEMORY_BYTES) -> SpooledUpload:
+    """
+    Copy a readable stream into a SpooledUpload in fixed-size chunks,
+    raising UploadTooLarge as soon as the size limit is crossed
+    """
+    if isinstance(stream, SpooledUpload):
+        stream.filename = stream.filename or filename or ''
+        return stream
+
+    upload = SpooledUpload(filename, max_bytes=max_bytes, max_memory=max_memory)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            upload.write(chunk)
+    except Exception:
+        upload.close()
+        raise
+    return upload
@@ -1,13 +1,15 @@
-import cv2
 import numpy as np
-from PIL import Image
-import io
-from app.models.database import get_doctor_by_license
-from typing import Dict, Any
+from app.models.database import get_doctor_by_license, get_prescriber_stats
+from app.models.write_behind import record_prescriber_stats
+from app.utils.prescriber_stats import anomaly_score, build_stats_update
+from app.utils.upload import SpooledUpload
+from typing import Dict, Any, Iterable, List, Optional
 
-def verify_doctor(license_number: str) -> Dict[str, Any]:
+def verify_doctor(license_number: str, medications: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """
-    Verify doctor's license number against the database
+    Verify doctor's license number against the database and, if the
+    prescription's medications are given, score it against the doctor's
+    prescribing history
     """
     if not license_number:
         return {
@@ -23,7 +25,7 @@ def verify_doctor(license_number: str) -> Dict[str, Any]:
             'message': 'License number not found in database'
         }
     
-    return {
+    verification = {
         'is_valid': True,
         'doctor_info': {
             'name': doctor.get('name'),
@@ -31,52 +33,78 @@ def verify_doctor(license_number: str) -> Dict[str, Any]:
             'license_status': doctor.get('status')
         }
     }
+    if medications is not None:
+        verification['anomaly'] = score_prescriber(license_number, medications)
+    return verification
 
-def detect_tampering(file) -> Dict[str, Any]:
+def score_prescriber(license_number: str, medications: List[Dict[str, Any]],
+                     stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Score a prescription against the doctor's running aggregates, loading them unless given"""
+    if stats is None:
+        stats = get_prescriber_stats(license_number)
+    return anomaly_score(stats, medications)
+
+def record_prescriber_activity(license_number: str, medications: List[Dict[str, Any]],
+                               stats: Optional[Dict[str, Any]] = None) -> None:
     """
-    Detect potential tampering in the prescription image
+    Queue a verified prescription for folding into the doctor's running
+    aggregates; with the current aggregates, expired day buckets are removed too
     """
-    # Convert file to image
-    if file.filename.lower().endswith('.pdf'):
-        from pdf2image import convert_from_bytes
-        images = convert_from_bytes(file.read())
-        image = np.array(images[0])
-    else:
-        image = np.array(Image.open(file))
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if not license_number:
+        return
+    record_prescriber_stats(license_number, build_stats_update(medications, stats))
+
+def grayscale_page(upload: SpooledUpload) -> np.ndarray:
+    """Grayscale array of the page already decoded for OCR"""
+    import cv2
+    return cv2.cvtColor(np.asarray(upload.first_page()), cv2.COLOR_RGB2GRAY)
+
+# Tamper checks in the order they run; the optional ones are skipped in degraded mode
+TAMPER_CHECKS = ('noise_level', 'text_alignment', 'image_splicing', 'font_consistency')
+CORE_TAMPER_CHECKS = ('noise_level', 'image_splicing')
+
+def detect_tampering(gray: np.ndarray, checks: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Detect potential tampering in the grayscale prescription image,
+    running only the named checks if given
+    """
+    checks = TAMPER_CHECKS if checks is None else tuple(checks)
     
     # Initialize results
     results = {
         'is_tampered': False,
         'confidence': 0.0,
-        'detected_issues': []
+        'detected_issues': [],
+        'checks_run': [check for check in TAMPER_CHECKS if check in checks]
     }
     
     # 1. Check for digital manipulation artifacts
-    noise_level = detect_noise_level(gray)
-    if noise_level > 0.8:
-        results['detected_issues'].append('High noise level detected')
-        results['confidence'] += 0.3
+    if 'noise_level' in checks:
+        noise_level = detect_noise_level(gray)
+        if noise_level > 0.8:
+            results['detected_issues'].append('High noise level detected')
+            results['confidence'] += 0.3
     
     # 2. Check for inconsistent text alignment
-    alignment_score = check_text_alignment(gray)
-    if alignment_score > 0.7:
-        results['detected_issues'].append('Inconsistent text alignment detected')
-        results['confidence'] += 0.2
+    if 'text_alignment' in checks:
+        alignment_score = check_text_alignment(gray)
+        if alignment_score > 0.7:
+            results['detected_issues'].append('Inconsistent text alignment detected')
+            results['confidence'] += 0.2
     
     # 3. Check for image splicing
-    splicing_score = detect_image_splicing(gray)
-    if splicing_score > 0.6:
-        results['detected_issues'].append('Possible image splicing detected')
-        results['confidence'] += 0.3
+    if 'image_splicing' in checks:
+        splicing_score = detect_image_splicing(gray)
+        if splicing_score > 0.6:
+            results['detected_issues'].append('Possible image splicing detected')
+            results['confidence'] += 0.3
     
     # 4. Check for inconsistent font patterns
-    font_score = analyze_font_consistency(gray)
-    if font_score > 0.7:
-        results['detected_issues'].append('Inconsistent font patterns detected')
-        results['confidence'] += 0.2
+    if 'font_consistency' in checks:
+        font_score = analyze_font_consistency(gray)
+        if font_score > 0.7:
+            results['detected_issues'].append('Inconsistent font patterns detected')
+            results['confidence'] += 0.2
     
     # Determine if document is likely tampered
     results['is_tampered'] = results['confidence'] > 0.5
@@ -85,6 +113,7 @@ def detect_tampering(file) -> Dict[str, Any]:
 
 def detect_noise_level(image: np.ndarray) -> float:
     """Detect noise level in the image"""
+    import cv2
     # Apply Gaussian blur
     blurred = cv2.GaussianBlur(image, (5, 5), 0)
     
@@ -98,6 +127,7 @@ def detect_noise_level(image: np.ndarray) -> float:
 
 def check_text_alignment(image: np.ndarray) -> float:
     """Check for inconsistent text alignment"""
+    import cv2
     # Apply edge detection
     edges = cv2.Canny(image, 50, 150)
     
@@ -116,11 +146,12 @@ def check_text_alignment(image: np.ndarray) -> float:
 
 def detect_image_splicing(image: np.ndarray) -> float:
     """Detect potential image splicing"""
+    import cv2
     # Apply Error Level Analysis (ELA)
     quality = 90
-    temp_path = 'temp.jpg'
-    cv2.imwrite(temp_path, image, [cv2.IMWRITE_JPEG_QUALITY, quality])
-    compressed = cv2.imread(temp_path, cv2.IMREAD_GRAYSCALE)
+    # Re-compress in memory; a shared temp file races between concurrent requests
+    _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    compressed = cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
     
     # Calculate difference
     diff = cv2.absdiff(image, compressed)
@@ -132,6 +163,7 @@ def detect_image_splicing(image: np.ndarray) -> float:
 
 def analyze_font_consistency(image: np.ndarray) -> float:
     """Analyze font consistency in the image"""
+    import cv2
     # Apply adaptive thresholding
     thresh = cv2.adaptiveThreshold(
         image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
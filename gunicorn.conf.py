@@ -0,0 +1,33 @@
+# gunicorn -c gunicorn.conf.py app:app
+import gc
+import os
+import time
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Import the app once in the master so workers inherit it instead of importing it again
+preload_app = True
+
+
+def when_ready(server):
+    """Load models in the master before any worker is forked"""
+    if os.getenv('WARM_UP', '1') != '1':
+        return
+    from app.startup import warm_up, format_timings
+    warm_up()
+    # Move everything loaded so far out of the collector's reach, so collections
+    # in the workers do not touch (and copy) the shared pages
+    gc.freeze()
+    server.log.info('Warm-up finished: %s', format_timings())
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    elapsed = time.perf_counter() - worker.forked_at
+    worker.log.info('Worker %s ready %.0fms after fork', worker.pid, elapsed * 1000)